@@ -0,0 +1,382 @@
+# batch_ocr.py
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from mistralai import FileTypedDict
+
+from config import Config
+from utils import HashingReader
+from cancellation import ProcessingCancelled
+from retry import RetryState
+
+# 任务进入这些状态后不会再变化，可以拉取结果
+TERMINAL_STATUSES = {"SUCCESS", "FAILED", "TIMEOUT_EXCEEDED", "CANCELLED"}
+
+
+class BatchJobClient(ABC):
+    """
+    批量OCR任务客户端接口。
+    BatchOCRRunner只依赖这些方法，测试时可以替换为本地的假实现。
+    """
+
+    @abstractmethod
+    def prepare_document(self, pdf_path: Path) -> Dict[str, str]:
+        """准备单个文档，返回 {"document_url", "file_id", "file_hash"}。"""
+
+    @abstractmethod
+    def submit(self, requests: List[dict]) -> str:
+        """提交一组 {"custom_id", "body"} 请求，返回任务ID。"""
+
+    @abstractmethod
+    def get_status(self, job_id: str) -> str:
+        """返回任务状态，进入 TERMINAL_STATUSES 后可以拉取结果。"""
+
+    @abstractmethod
+    def fetch_results(self, job_id: str) -> Iterator[Tuple[str, Optional[dict], Optional[str]]]:
+        """逐条返回 (custom_id, OCR结果, 错误信息)。"""
+
+    @abstractmethod
+    def delete_file(self, file_id: str):
+        """删除上传的文档。"""
+
+    def cleanup(self, job_id: str):
+        """任务结束后清理任务相关的临时文件。"""
+        pass
+
+
+class MistralBatchClient(BatchJobClient):
+    def __init__(self, client):
+        self.client = client
+        self.logger = logging.getLogger(f"{__name__}.MistralBatchClient")
+
+    def prepare_document(self, pdf_path: Path) -> Dict[str, str]:
+        with HashingReader(pdf_path) as reader:
+            uploaded = self.client.files.upload(
+                file=FileTypedDict(file_name=pdf_path.stem, content=reader),
+                purpose="ocr"
+            )
+            file_hash = reader.hexdigest()
+        signed_url = self.client.files.get_signed_url(
+            file_id=uploaded.id, expiry=Config.BATCH_URL_EXPIRY_HOURS
+        ).url
+        return {"document_url": signed_url, "file_id": uploaded.id, "file_hash": file_hash}
+
+    def submit(self, requests: List[dict]) -> str:
+        content = "\n".join(json.dumps(r, ensure_ascii=False) for r in requests).encode("utf-8")
+        input_file = self.client.files.upload(
+            file=FileTypedDict(file_name=f"ocr_batch_{int(time.time())}.jsonl", content=content),
+            purpose="batch"
+        )
+        job = self.client.batch.jobs.create(
+            input_files=[input_file.id],
+            model=Config.MODEL_NAME,
+            endpoint="/v1/ocr",
+            timeout_hours=Config.BATCH_TIMEOUT_HOURS
+        )
+        return job.id
+
+    def get_status(self, job_id: str) -> str:
+        return self.client.batch.jobs.get(job_id=job_id).status
+
+    def fetch_results(self, job_id: str) -> Iterator[Tuple[str, Optional[dict], Optional[str]]]:
+        job = self.client.batch.jobs.get(job_id=job_id)
+        for file_id in (job.output_file, job.error_file):
+            if not file_id:
+                continue
+            response = self.client.files.download(file_id=file_id)
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                custom_id = entry.get("custom_id")
+                body = (entry.get("response") or {}).get("body")
+                status_code = (entry.get("response") or {}).get("status_code")
+                if status_code == 200 and body:
+                    yield custom_id, body, None
+                else:
+                    error = entry.get("error") or body or f"状态码: {status_code}"
+                    yield custom_id, None, str(error)
+
+    def delete_file(self, file_id: str):
+        self.client.files.delete(file_id=file_id)
+
+    def cleanup(self, job_id: str):
+        job = self.client.batch.jobs.get(job_id=job_id)
+        for file_id in job.input_files:
+            try:
+                self.client.files.delete(file_id=file_id)
+            except Exception as e:
+                self.logger.warning(f"清理批量输入文件失败 {file_id}: {e}")
+
+
+class BatchOCRRunner:
+    """
+    批量OCR模式：上传文档、提交批量任务、轮询状态，完成后把结果汇入
+    PDFProcessor.process_ocr_result。任务状态保存在JSON文件中，程序重启后可继续。
+    """
+
+    def __init__(self, processor, job_client: BatchJobClient, state_path: Path = None,
+                 poll_interval: float = None, chunk_size: int = None):
+        self.processor = processor
+        self.job_client = job_client
+        self.state_path = Path(state_path or Config.BATCH_STATE_PATH)
+        self.poll_interval = poll_interval if poll_interval is not None else Config.BATCH_POLL_INTERVAL
+        self.chunk_size = chunk_size or Config.BATCH_CHUNK_SIZE
+        self.logger = logging.getLogger(f"{__name__}.BatchOCRRunner")
+        self.lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            try:
+                state = json.loads(self.state_path.read_text(encoding="utf-8"))
+                state.setdefault("prepared", {})
+                return state
+            except Exception as e:
+                self.logger.error(f"读取批量任务状态失败，忽略旧状态: {e}")
+        return {"jobs": {}, "prepared": {}}
+
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.state, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(self.state_path)
+
+    def pending_documents(self) -> List[Path]:
+        """尚未拿到结果的文档（包括上次运行遗留的任务和已上传但尚未提交的文档）。"""
+        with self.lock:
+            return [
+                Path(doc["path"])
+                for job in self.state["jobs"].values()
+                for doc in job["documents"].values()
+                if not doc.get("done")
+            ] + [Path(doc["path"]) for doc in self.state["prepared"].values()]
+
+    def submit(self, pdf_paths: List[Path], enable_dify: bool = False,
+               should_stop: Callable[[], bool] = None,
+               on_upload_failed: Callable[[Path, RetryState], None] = None) -> List[str]:
+        """
+        上传新文档并提交批量任务。每个文档上传后立即写入状态文件，
+        提交失败或中途退出时已上传的文档保留在状态中，下次提交时直接使用，不会重复上传。
+        上传失败的文档不会进入批量任务，通过 on_upload_failed 通知调用方。
+        """
+        retry_paths = self._drop_expired_uploads()
+        pending = {str(p) for p in self.pending_documents()}
+        new_paths = retry_paths + [p for p in pdf_paths if str(p) not in pending]
+        job_ids = self._submit_prepared(force=False)
+        for pdf_path in new_paths:
+            if should_stop and should_stop():
+                break
+            try:
+                self.logger.info(f"上传PDF到Mistral(批量): {pdf_path.name}")
+                prepared = self.job_client.prepare_document(pdf_path)
+            except Exception as e:
+                self.logger.error(f"❌ 批量上传失败 {pdf_path.name}: {e}")
+                state = self._failed_state(f"批量上传失败: {e}")
+                self.processor.tracker.update_record(pdf_path.name, note=f"OCR错误: {e}", last_error=state.last_error)
+                if on_upload_failed:
+                    on_upload_failed(pdf_path, state)
+                continue
+            with self.lock:
+                seq = self.state.get("next_seq", 0)
+                self.state["next_seq"] = seq + 1
+                self.state["prepared"][f"{seq}_{pdf_path.stem}"] = {
+                    "path": str(pdf_path),
+                    "file_id": prepared["file_id"],
+                    "document_url": prepared["document_url"],
+                    "enable_dify": enable_dify,
+                    "prepared_at": time.time()
+                }
+                self._save_state()
+            self.processor.tracker.update_record(pdf_path.name, file_hash=prepared.get("file_hash", ""))
+            job_ids += self._submit_prepared(force=False)
+        if not (should_stop and should_stop()):
+            job_ids += self._submit_prepared(force=True)
+        return job_ids
+
+    def _drop_expired_uploads(self) -> List[Path]:
+        """签名URL即将过期的已上传文档：删除上传文件，返回需要重新上传的路径。"""
+        max_age = max(Config.BATCH_URL_EXPIRY_HOURS - 1, 0) * 3600
+        with self.lock:
+            expired = {cid: doc for cid, doc in self.state["prepared"].items()
+                       if time.time() - doc.get("prepared_at", 0) > max_age}
+            for cid in expired:
+                del self.state["prepared"][cid]
+            if expired:
+                self._save_state()
+        for doc in expired.values():
+            try:
+                self.job_client.delete_file(doc["file_id"])
+            except Exception as e:
+                self.logger.warning(f"清理过期上传文件失败 {doc['file_id']}: {e}")
+        return [Path(doc["path"]) for doc in expired.values()]
+
+    def _submit_prepared(self, force: bool) -> List[str]:
+        """
+        把已上传的文档按 chunk_size 分组提交；force=False 时只提交满一组的文档。
+        提交失败时文档保留在状态文件中，稍后重试。
+        """
+        job_ids = []
+        while True:
+            with self.lock:
+                groups = {}
+                for cid, doc in self.state["prepared"].items():
+                    groups.setdefault(doc["enable_dify"], []).append(cid)
+                ready = [ids[:self.chunk_size] for ids in groups.values()
+                         if len(ids) >= self.chunk_size or (force and ids)]
+                if not ready:
+                    return job_ids
+                custom_ids = ready[0]
+                documents = {cid: dict(self.state["prepared"][cid]) for cid in custom_ids}
+            enable_dify = next(iter(documents.values()))["enable_dify"]
+            requests = [{
+                "custom_id": cid,
+                "body": {
+                    "document": {"type": "document_url", "document_url": doc["document_url"]},
+                    "include_image_base64": True
+                }
+            } for cid, doc in documents.items()]
+            try:
+                job_id = self.job_client.submit(requests)
+            except Exception as e:
+                self.logger.error(f"❌ 提交批量OCR任务失败（{len(requests)}个已上传文件保留，稍后重试）: {e}")
+                return job_ids
+            with self.lock:
+                for cid in custom_ids:
+                    del self.state["prepared"][cid]
+                self.state["jobs"][job_id] = {
+                    "status": "QUEUED",
+                    "enable_dify": enable_dify,
+                    "submitted_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "documents": {cid: {"path": doc["path"], "file_id": doc["file_id"], "done": False}
+                                  for cid, doc in documents.items()}
+                }
+                self._save_state()
+            for doc in documents.values():
+                self.processor.tracker.update_record(Path(doc["path"]).name, note=f"批量OCR排队中 ({job_id})")
+            self.logger.info(f"📦 已提交批量OCR任务 {job_id}: {len(requests)} 个文件")
+            job_ids.append(job_id)
+
+    def run(self, pdf_paths: List[Path], enable_dify: bool = False,
+            on_document_done: Callable[[Path, bool, RetryState], None] = None,
+            should_stop: Callable[[], bool] = None,
+            on_upload_failed: Callable[[Path, RetryState], None] = None) -> Tuple[int, int]:
+        """
+        提交新文件并处理所有未完成任务（含上次遗留的），返回 (成功数, 完成数)。
+        on_document_done 收到每个文档的 RetryState，其中 failed_stage/last_error 记录失败阶段（包括OCR成功但Dify失败）。
+        """
+        self.submit(pdf_paths, enable_dify, should_stop, on_upload_failed)
+        success_count = done_count = 0
+        while True:
+            with self.lock:
+                has_prepared = bool(self.state["prepared"])
+            if has_prepared and not (should_stop and should_stop()):
+                # 之前提交失败的已上传文档，每轮轮询时重试提交
+                self._submit_prepared(force=True)
+            with self.lock:
+                open_jobs = list(self.state["jobs"].keys())
+            if not open_jobs or (should_stop and should_stop()):
+                break
+            for job_id in open_jobs:
+                if should_stop and should_stop():
+                    break
+                try:
+                    status = self.job_client.get_status(job_id)
+                except Exception as e:
+                    self.logger.warning(f"查询批量任务状态失败 {job_id}: {e}")
+                    continue
+                with self.lock:
+                    self.state["jobs"][job_id]["status"] = status
+                if status not in TERMINAL_STATUSES:
+                    continue
+                self.logger.info(f"📬 批量OCR任务结束 {job_id}: {status}")
+                ok, done = self._collect_job(job_id, on_document_done)
+                success_count += ok
+                done_count += done
+            else:
+                self._wait(should_stop)
+        return success_count, done_count
+
+    def _wait(self, should_stop):
+        deadline = time.monotonic() + self.poll_interval
+        while time.monotonic() < deadline:
+            if should_stop and should_stop():
+                return
+            time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+
+    @staticmethod
+    def _failed_state(error: str) -> RetryState:
+        state = RetryState()
+        state.failed_stage = "ocr"
+        state.last_error = f"OCR: {error}"
+        return state
+
+    def _collect_job(self, job_id: str, on_document_done) -> Tuple[int, int]:
+        with self.lock:
+            job = self.state["jobs"][job_id]
+        success_count = done_count = 0
+        try:
+            results = self.job_client.fetch_results(job_id)
+            for custom_id, ocr_result, error in results:
+                doc = job["documents"].get(custom_id)
+                if not doc or doc.get("done"):
+                    continue
+                pdf_path = Path(doc["path"])
+                if ocr_result is not None:
+                    state = RetryState()
+                    try:
+                        success = self.processor.process_ocr_result(pdf_path, ocr_result, job["enable_dify"],
+                                                                    state, retryable=False)
+                    except Exception as e:
+                        self.logger.error(f"❌ 处理失败 {pdf_path.name}: {e}")
+                        self.processor.tracker.update_record(pdf_path.name, note=f"OCR错误: {e}")
+                        state = self._failed_state(str(e))
+                        success = False
+                else:
+                    self.logger.error(f"❌ 批量OCR失败 {pdf_path.name}: {error}")
+                    self.processor.tracker.update_record(pdf_path.name, note=f"OCR错误: {error}")
+                    state = self._failed_state(str(error))
+                    success = False
+                with self.lock:
+                    doc["done"] = True
+                    self._save_state()
+                success_count += int(success)
+                done_count += 1
+                if on_document_done:
+                    on_document_done(pdf_path, success, state)
+        except ProcessingCancelled:
+            # 任务保留在状态文件中，恢复时重新拉取尚未处理的结果
+            self.logger.info(f"⏹️ 停止处理批量任务结果 {job_id}，可稍后恢复")
+            return success_count, done_count
+        except Exception as e:
+            self.logger.error(f"💥 拉取批量任务结果失败 {job_id}: {e}")
+            return success_count, done_count
+
+        # 任务没有返回结果的文档记为失败
+        for doc in job["documents"].values():
+            if not doc.get("done"):
+                pdf_path = Path(doc["path"])
+                self.processor.tracker.update_record(pdf_path.name, note=f"OCR错误: 批量任务{job['status']}未返回结果")
+                done_count += 1
+                if on_document_done:
+                    on_document_done(pdf_path, False, self._failed_state(f"批量任务{job['status']}未返回结果"))
+
+        for doc in job["documents"].values():
+            try:
+                self.job_client.delete_file(doc["file_id"])
+            except Exception as e:
+                self.logger.warning(f"清理上传文件失败 {doc['file_id']}: {e}")
+        try:
+            self.job_client.cleanup(job_id)
+        except Exception as e:
+            self.logger.warning(f"清理批量任务文件失败 {job_id}: {e}")
+
+        with self.lock:
+            del self.state["jobs"][job_id]
+            self._save_state()
+        return success_count, done_count
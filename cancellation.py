@@ -0,0 +1,128 @@
+# cancellation.py
+import threading
+import time
+from contextlib import contextmanager
+
+# 等待网络调用时检查取消/超时的间隔（秒）
+POLL_INTERVAL = 0.2
+
+
+class ProcessingCancelled(BaseException):
+    """
+    用户停止处理。继承BaseException，避免被各阶段通用的 except Exception 吞掉，
+    一直传递到批处理循环。
+    """
+
+    def __init__(self, stage: str = ""):
+        self.stage = stage
+        super().__init__(f"已取消（{stage}阶段）" if stage else "已取消")
+
+
+class JobAborted(ProcessingCancelled):
+    """只中止当前线程正在处理的任务（如共享队列的租约已丢失），其他任务继续。"""
+
+    def __init__(self, stage: str = ""):
+        super().__init__(stage)
+        self.args = (f"任务已中止（{stage}阶段）" if stage else "任务已中止",)
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage: str, timeout: float):
+        self.stage = stage
+        self.timeout = timeout
+        super().__init__(f"{stage}阶段超时（超过 {timeout:g}s）")
+
+
+class CancelToken:
+    """在GUI、PDFProcessor和DifyProcessor之间传递的取消标记，并为每个阶段提供截止时间。"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._local = threading.local()
+
+    def cancel(self):
+        self._event.set()
+
+    def _job_event(self):
+        return getattr(self._local, "job_event", None)
+
+    @contextmanager
+    def job_scope(self, job_event: threading.Event):
+        """在当前线程内关联一个任务级的中止标记，job_event被set后只中止本线程正在处理的任务。"""
+        previous = self._job_event()
+        self._local.job_event = job_event
+        try:
+            yield
+        finally:
+            self._local.job_event = previous
+
+    def _cancel_error(self, stage: str):
+        if self._event.is_set():
+            return ProcessingCancelled(stage)
+        job_event = self._job_event()
+        if job_event is not None and job_event.is_set():
+            return JobAborted(stage)
+        return None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_error("") is not None
+
+    def raise_if_cancelled(self, stage: str = ""):
+        error = self._cancel_error(stage)
+        if error is not None:
+            raise error
+
+    def wait(self, seconds: float, stage: str = ""):
+        """可被取消的sleep。"""
+        if self._job_event() is None:
+            if self._event.wait(seconds):
+                raise ProcessingCancelled(stage)
+            return
+        deadline = time.monotonic() + seconds
+        while True:
+            self.raise_if_cancelled(stage)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._event.wait(min(POLL_INTERVAL, remaining))
+
+    def run(self, stage: str, func, *args, timeout: float = None, on_late_result=None, **kwargs):
+        """
+        在辅助线程中执行阻塞的网络调用，每隔POLL_INTERVAL检查一次取消和截止时间。
+        放弃等待后调用仍在后台完成时，结果交给on_late_result处理（如清理已上传的文件）。
+        """
+        self.raise_if_cancelled(stage)
+        lock = threading.Lock()
+        done = threading.Event()
+        outcome = {}
+
+        def target():
+            try:
+                result = func(*args, **kwargs)
+                error = None
+            except BaseException as e:
+                result, error = None, e
+            with lock:
+                outcome.update(result=result, error=error)
+                late = outcome.get("abandoned", False)
+                done.set()
+            if late and error is None and on_late_result:
+                on_late_result(result)
+
+        threading.Thread(target=target, name=f"stage-{stage}", daemon=True).start()
+        deadline = time.monotonic() + timeout if timeout else None
+        while not done.wait(POLL_INTERVAL):
+            give_up = self._cancel_error(stage)
+            if give_up is None and deadline and time.monotonic() >= deadline:
+                give_up = StageTimeout(stage, timeout)
+            if give_up is not None:
+                with lock:
+                    if not done.is_set():
+                        outcome["abandoned"] = True
+                        raise give_up
+                break
+
+        if outcome["error"] is not None:
+            raise outcome["error"]
+        return outcome["result"]
@@ -1,4 +1,5 @@
 import os
+import socket
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -13,14 +14,79 @@ class Config:
     DIFY_API_KEY = os.getenv("DIFY_API_KEY")
     DIFY_BASE_URL = os.getenv("DIFY_BASE_URL", "http://localhost")
     ENABLE_DIFY = os.getenv("ENABLE_DIFY", "false").lower() == "true"
+    DIFY_WORKFLOW_ID = os.getenv("DIFY_WORKFLOW_ID", "")
 
     # 路径配置
     MD_OUT_DIR = Path(os.getenv("MD_OUT_DIR", "./output/markdown"))
     IMAGE_DIR = Path(os.getenv("IMAGE_DIR", "./output/images"))
     EXCEL_PATH = Path(os.getenv("EXCEL_PATH", "./output/pdf_processing.xlsx"))
     DIFY_RESULT_DIR = Path(os.getenv("DIFY_RESULT_DIR", "./output/dify_results"))
+    DIFY_CACHE_DIR = Path(os.getenv("DIFY_CACHE_DIR", "./output/dify_cache"))
+    SEARCH_INDEX_DB = Path(os.getenv("SEARCH_INDEX_DB", "./output/search_index.db"))
+
+    # 日志配置
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", "20")) * 1024 * 1024)
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    LOG_PAYLOAD_LIMIT = int(os.getenv("LOG_PAYLOAD_LIMIT", "1000"))
 
     # 处理配置
     MODEL_NAME = "mistral-ocr-latest"
     MAX_WORKERS = 3
     DIFY_MAX_WORKERS = 2
+    DIFY_CACHE_ENABLED = os.getenv("DIFY_CACHE_ENABLED", "true").lower() == "true"
+
+    # 调度配置
+    SCHEDULER_POLICY = os.getenv("SCHEDULER_POLICY", "fifo")
+    SCHEDULER_MB_WEIGHT = float(os.getenv("SCHEDULER_MB_WEIGHT", "0.5"))
+
+    # OCR上传配置：小于该大小的PDF直接以base64内联发送OCR，跳过上传/签名URL/删除
+    INLINE_OCR_MAX_BYTES = int(float(os.getenv("INLINE_OCR_MAX_MB", "5")) * 1024 * 1024)
+
+    # 上传文件后台清理配置：失败重试次数、首次重试间隔(秒，之后指数退避)
+    REAPER_MAX_ATTEMPTS = int(os.getenv("REAPER_MAX_ATTEMPTS", "5"))
+    REAPER_RETRY_DELAY = float(os.getenv("REAPER_RETRY_DELAY", "2"))
+
+    # 各阶段超时（秒）
+    OCR_UPLOAD_TIMEOUT = float(os.getenv("OCR_UPLOAD_TIMEOUT", "300"))
+    OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "600"))
+    DIFY_UPLOAD_TIMEOUT = float(os.getenv("DIFY_UPLOAD_TIMEOUT", "30"))
+    DIFY_WORKFLOW_TIMEOUT = float(os.getenv("DIFY_WORKFLOW_TIMEOUT", "300"))
+    DIFY_RESULT_WAIT = float(os.getenv("DIFY_RESULT_WAIT", "120"))
+
+    # 临时性失败（网络中断、超时、限流、5xx）自动重试：OCR和Dify阶段分别计算次数，指数退避(秒)
+    RETRY_MAX_ATTEMPTS_OCR = int(os.getenv("RETRY_MAX_ATTEMPTS_OCR", "4"))
+    RETRY_MAX_ATTEMPTS_DIFY = int(os.getenv("RETRY_MAX_ATTEMPTS_DIFY", "3"))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "30"))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "600"))
+
+    # 多机共享队列（设置WORK_QUEUE_DB为共享目录下的数据库路径即启用）
+    WORK_QUEUE_DB = Path(os.getenv("WORK_QUEUE_DB")) if os.getenv("WORK_QUEUE_DB") else None
+    # 本机挂载PDF共享目录的位置（各主机可不同，如 Z:\pdfs、\\srv\share\pdfs、/mnt/share/pdfs）
+    WORK_QUEUE_SHARE_ROOT = Path(os.getenv("WORK_QUEUE_SHARE_ROOT")) if os.getenv("WORK_QUEUE_SHARE_ROOT") else None
+    HOST_ID = os.getenv("HOST_ID") or socket.gethostname()
+    WORK_QUEUE_LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "60"))
+    WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+
+    # 批量OCR模式配置
+    BATCH_STATE_PATH = Path(os.getenv("BATCH_STATE_PATH", "./output/batch_ocr_state.json"))
+    BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "200"))
+    BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+    BATCH_TIMEOUT_HOURS = int(os.getenv("BATCH_TIMEOUT_HOURS", "24"))
+    BATCH_URL_EXPIRY_HOURS = int(os.getenv("BATCH_URL_EXPIRY_HOURS", "48"))
+
+    # 实时统计面板：吞吐量滑动窗口(秒)、每阶段保留的耗时样本数、刷新间隔(毫秒)
+    STATS_WINDOW_SECONDS = float(os.getenv("STATS_WINDOW_SECONDS", "300"))
+    STATS_SAMPLES = int(os.getenv("STATS_SAMPLES", "200"))
+    STATS_REFRESH_MS = int(os.getenv("STATS_REFRESH_MS", "300"))
+
+    # 全文索引配置
+    SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+    SEARCH_INDEX_BATCH = int(os.getenv("SEARCH_INDEX_BATCH", "50"))
+
+    # 图片压缩配置（需要Pillow）
+    IMAGE_RECOMPRESS = os.getenv("IMAGE_RECOMPRESS", "false").lower() == "true"
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp")
+    IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+    IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "2000"))
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2)))
@@ -0,0 +1,109 @@
+# dify_cache.py
+import hashlib
+import json
+import logging
+import re
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+
+# Markdown头部的处理时间每次OCR都会变化，计算哈希时忽略
+_VOLATILE_HEADER = re.compile("^<!-- 处理时间: .*? -->\r?\n".encode("utf-8"), re.MULTILINE)
+
+
+class DifyResultCache:
+    """
+    Dify工作流结果缓存，键为 Markdown内容哈希 + 工作流ID。
+    命中时直接恢复之前的结果文件，不再重新上传和运行工作流。
+    """
+
+    def __init__(self, cache_dir: Path = None, workflow_id: str = None, refresh: bool = False):
+        self.cache_dir = Path(cache_dir or Config.DIFY_CACHE_DIR)
+        self.workflow_id = workflow_id if workflow_id is not None else Config.DIFY_WORKFLOW_ID
+        self.refresh = refresh
+        self.index_path = self.cache_dir / "index.json"
+        self.files_dir = self.cache_dir / "files"
+        self.logger = logging.getLogger(f"{__name__}.DifyResultCache")
+        self.lock = threading.Lock()
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        if self.index_path.exists():
+            try:
+                return json.loads(self.index_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                self.logger.warning(f"读取Dify缓存索引失败，重新建立: {e}")
+        return {}
+
+    def _save_index(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.index, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(self.index_path)
+
+    def key_for(self, md_path: Path) -> str:
+        content = _VOLATILE_HEADER.sub(b"", md_path.read_bytes())
+        digest = hashlib.sha256()
+        digest.update(self.workflow_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(content)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        if self.refresh:
+            return None
+        with self.lock:
+            entry = self.index.get(key)
+        if entry and not (self.files_dir / f"{key}.txt").exists():
+            self.logger.warning(f"Dify缓存文件丢失，忽略缓存: {entry.get('pdf_name')}")
+            return None
+        return entry
+
+    def put(self, key: str, pdf_name: str, result_file: Path, status: str,
+            dify_result: str, file_id: str = ""):
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(result_file, self.files_dir / f"{key}.txt")
+        with self.lock:
+            self.index[key] = {
+                "pdf_name": pdf_name,
+                "workflow_id": self.workflow_id,
+                "result_name": result_file.name,
+                "status": status,
+                "dify_result": dify_result,
+                "file_id": file_id,
+                "cached_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self._save_index()
+        self.logger.info(f"💾 已缓存Dify结果: {pdf_name}")
+
+    def restore(self, key: str, entry: dict) -> Path:
+        """把缓存的结果文件恢复到Dify结果目录，返回恢复后的路径。"""
+        Config.DIFY_RESULT_DIR.mkdir(parents=True, exist_ok=True)
+        target = Config.DIFY_RESULT_DIR / entry["result_name"]
+        shutil.copy2(self.files_dir / f"{key}.txt", target)
+        return target
+
+    def invalidate(self, pdf_name: str) -> int:
+        """删除某个文档的所有缓存条目，返回删除数量。"""
+        with self.lock:
+            keys = [k for k, v in self.index.items() if v.get("pdf_name") == pdf_name]
+            for key in keys:
+                del self.index[key]
+                (self.files_dir / f"{key}.txt").unlink(missing_ok=True)
+            if keys:
+                self._save_index()
+        return len(keys)
+
+    def clear(self) -> int:
+        with self.lock:
+            count = len(self.index)
+            self.index = {}
+            if self.files_dir.exists():
+                shutil.rmtree(self.files_dir)
+            self._save_index()
+        self.logger.info(f"🗑️ 已清除Dify缓存: {count} 条")
+        return count
@@ -1,16 +1,25 @@
 # dify_processor.py
 
-import time
+import threading
 from pathlib import Path
 from config import Config
 import requests
 from datetime import datetime
 import logging
-from typing import Optional
+from typing import Dict, Optional, Tuple
+from utils import summarize_payload
+from cancellation import CancelToken, ProcessingCancelled, StageTimeout
+from stats import ProcessingStats
+from retry import is_transient, is_transient_status
 
 class DifyProcessor:
-    def __init__(self, tracker):
+    def __init__(self, tracker, cache=None, cancel_token: CancelToken = None, stats: ProcessingStats = None):
         self.tracker = tracker
+        self.cache = cache
+        self.cancel_token = cancel_token or CancelToken()
+        self.stats = stats or ProcessingStats()
+        # 多个OCR工作线程共享一个DifyProcessor，限制同时运行的工作流数量
+        self.slots = threading.BoundedSemaphore(Config.DIFY_MAX_WORKERS)
         self.logger = logging.getLogger(f"{__name__}.DifyProcessor")
         self.api_key = Config.DIFY_API_KEY
         self.base_url = Config.DIFY_BASE_URL.rstrip('/')
@@ -23,23 +32,51 @@ class DifyProcessor:
             return {"success": False, "error": "Dify API未配置"}
 
         pdf_name = md_path.stem
+
+        cache_key = None
+        if self.cache:
+            try:
+                cache_key = self.cache.key_for(md_path)
+                cached = self.cache.get(cache_key)
+                if cached:
+                    return self._restore_cached(pdf_name, cache_key, cached)
+            except Exception as e:
+                self.logger.warning(f"⚠️ 读取Dify缓存失败，继续正常处理: {e}")
+
+        self.tracker.update_record(pdf_name, dify_status="排队中...")
+        with self.stats.stage("dify_queue"):
+            while not self.slots.acquire(timeout=0.2):
+                self.cancel_token.raise_if_cancelled("Dify排队")
+        try:
+            return self._process_markdown(md_path, pdf_name, user_id, cache_key)
+        finally:
+            self.slots.release()
+
+    def _process_markdown(self, md_path: Path, pdf_name: str, user_id: str, cache_key: Optional[str]) -> dict:
         self.tracker.update_record(pdf_name, dify_status="正在上传...")
 
         try:
             self.logger.info(f"📤 上传文件到Dify: {md_path.name}")
-            file_id = self._upload_file(md_path, user_id)
-            if not file_id:
-                return {"success": False, "error": "文件上传失败"}
+            with self.stats.stage("dify_upload"):
+                upload = self._upload_file(md_path, user_id)
+            if not upload.get("success"):
+                self.tracker.update_record(pdf_name, dify_status="❌上传失败", dify_result="❌")
+                return upload
+            file_id = upload["file_id"]
 
             self.tracker.update_record(pdf_name, dify_file_id=file_id, dify_status="正在处理...")
 
             self.logger.info(f"🔄 运行Dify工作流，文件ID: {file_id}")
-            result = self._run_workflow(file_id, user_id)
+            existing_results = self._snapshot_results(user_id)
+            with self.stats.stage("workflow"):
+                result = self._run_workflow(file_id, user_id)
 
             if result.get("success"):
                 self.logger.info(f"🔍 等待TXT文本生成节点创建结果文件...")
-                time.sleep(5)
-                result_file = self._check_result_file(pdf_name, user_id, max_wait=120)
+                with self.stats.stage("result_wait"):
+                    self.cancel_token.wait(5, "Dify结果等待")
+                    result_file = self._check_result_file(pdf_name, user_id, existing_results,
+                                                          max_wait=Config.DIFY_RESULT_WAIT)
                 if result_file:
                     status = "✅完成"
                     dify_result = "✅"
@@ -53,6 +90,12 @@ class DifyProcessor:
                     dify_status=status,
                     dify_result=dify_result
                 )
+                # _check_result_file只返回属于本文档的本次结果，可以直接缓存
+                if self.cache and cache_key and result_file:
+                    try:
+                        self.cache.put(cache_key, pdf_name, result_file, status, dify_result, file_id)
+                    except Exception as e:
+                        self.logger.warning(f"⚠️ 写入Dify缓存失败: {e}")
                 return {
                     "success": True,
                     "file_id": file_id,
@@ -64,11 +107,35 @@ class DifyProcessor:
                 self.tracker.update_record(pdf_name, dify_status="❌失败", dify_result="❌")
                 return result
 
+        except ProcessingCancelled:
+            self.tracker.update_record(pdf_name, dify_status="⏹️已取消", dify_result="❌")
+            raise
+        except StageTimeout as e:
+            self.logger.error(f"⏱️ Dify处理超时 {pdf_name}: {e}")
+            self.tracker.update_record(pdf_name, dify_status=f"⏱️超时({e.stage})", dify_result="❌")
+            return {"success": False, "error": str(e), "timed_out": True, "transient": True}
         except Exception as e:
             error_msg = str(e)
             self.logger.error(f"💥 Dify处理失败 {pdf_name}: {error_msg}")
             self.tracker.update_record(pdf_name, dify_status="❌错误", dify_result="❌")
-            return {"success": False, "error": error_msg}
+            return {"success": False, "error": error_msg, "transient": is_transient(e)}
+
+    def _restore_cached(self, pdf_name: str, cache_key: str, cached: dict) -> dict:
+        result_file = self.cache.restore(cache_key, cached)
+        self.logger.info(f"♻️ 命中Dify缓存: {pdf_name} -> {result_file.name}（缓存于 {cached.get('cached_at')}）")
+        self.tracker.update_record(
+            pdf_name,
+            dify_status=f"{cached['status']}(缓存)",
+            dify_file_id=cached.get("file_id", ""),
+            dify_result=cached["dify_result"]
+        )
+        return {
+            "success": True,
+            "file_id": cached.get("file_id", ""),
+            "result_file": result_file,
+            "found_result_file": True,
+            "cached": True
+        }
 
     def _upload_file(self, file_path: Path, user_id: str):
         upload_url = f"{self.base_url}/v1/files/upload"
@@ -84,22 +151,30 @@ class DifyProcessor:
                     "user": user_id,
                     "type": "document"
                 }
-                response = requests.post(upload_url, headers=headers, files=files, data=data, timeout=30)
+                response = self.cancel_token.run(
+                    "Dify上传",
+                    lambda: requests.post(upload_url, headers=headers, files=files, data=data,
+                                          timeout=Config.DIFY_UPLOAD_TIMEOUT),
+                    timeout=Config.DIFY_UPLOAD_TIMEOUT
+                )
                 if response.status_code == 201:
                     result = response.json()
                     file_id = result.get("id")
                     self.logger.info(f"✅ 文件上传成功: {file_id}")
-                    return file_id
+                    return {"success": True, "file_id": file_id}
                 else:
                     self.logger.error(f"❌ 文件上传失败，状态码: {response.status_code}")
-                    self.logger.error(f"响应内容: {response.text}")
-                    return None
+                    self.logger.error(f"响应内容: {summarize_payload(response.text)}")
+                    return {"success": False, "error": f"文件上传失败: {response.status_code}",
+                            "transient": is_transient_status(response.status_code)}
         except requests.exceptions.Timeout:
             self.logger.error("文件上传超时")
-            return None
+            return {"success": False, "error": "文件上传超时", "transient": True}
+        except StageTimeout:
+            raise
         except Exception as e:
             self.logger.error(f"上传过程异常: {str(e)}")
-            return None
+            return {"success": False, "error": f"文件上传失败: {e}", "transient": is_transient(e)}
 
     def _run_workflow(self, file_id: str, user_id: str, response_mode: str = "blocking") -> dict:
         workflow_url = f"{self.base_url}/v1/workflows/run"
@@ -119,42 +194,75 @@ class DifyProcessor:
             "user": user_id
         }
         try:
-            self.logger.info(f"🔄 发送工作流请求")
-            self.logger.info(f"📤 请求数据: {data}")
+            self.logger.info(f"🔄 发送工作流请求，文件ID: {file_id}")
+            self.logger.debug(f"📤 请求数据: {data}")
 
-            response = requests.post(workflow_url, headers=headers, json=data, timeout=300)
+            response = self.cancel_token.run(
+                "Dify工作流",
+                lambda: requests.post(workflow_url, headers=headers, json=data,
+                                      timeout=Config.DIFY_WORKFLOW_TIMEOUT),
+                timeout=Config.DIFY_WORKFLOW_TIMEOUT
+            )
             self.logger.info(f"📥 响应状态码: {response.status_code}")
             if response.status_code == 200:
                 result = response.json()
                 self.logger.info(f"✅ 工作流执行成功")
-                self.logger.info(f"📋 工作流结果: {result}")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"📋 工作流结果: {result}")
+                else:
+                    self.logger.info(f"📋 工作流结果: {summarize_payload(result)}")
                 return {"success": True, "result": result}
             else:
                 self.logger.error(f"❌ 工作流执行失败，状态码: {response.status_code}")
-                self.logger.error(f"📄 响应内容: {response.text}")
-                return {"success": False, "error": f"工作流失败: {response.status_code}"}
+                self.logger.error(f"📄 响应内容: {summarize_payload(response.text)}")
+                return {"success": False, "error": f"工作流失败: {response.status_code}",
+                        "transient": is_transient_status(response.status_code)}
+        except StageTimeout:
+            raise
         except Exception as e:
             self.logger.error(f"💥 工作流执行异常: {str(e)}")
-            return {"success": False, "error": str(e)}
+            return {"success": False, "error": str(e), "transient": is_transient(e)}
+
+    @staticmethod
+    def _snapshot_results(user_id: str) -> Dict[str, Tuple[int, int]]:
+        """
+        记录工作流开始前本文档已有的结果文件 {文件名: (mtime_ns, 大小)}。
+        结果文件由Dify容器通过挂载目录写入，其mtime来自容器/虚拟机时钟，不能与本机时间比较。
+        """
+        snapshot = {}
+        for f in Config.DIFY_RESULT_DIR.glob(f"{user_id}_response*.txt"):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            snapshot[f.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    @staticmethod
+    def _is_own_result(result_file: Path, user_id: str, existing: Dict[str, Tuple[int, int]]) -> bool:
+        """结果文件名以本文档的user_id开头，且是工作流开始后新生成或被改写的文件。"""
+        try:
+            stat = result_file.stat()
+        except OSError:
+            return False
+        return result_file.name.startswith(f"{user_id}_response") and \
+            existing.get(result_file.name) != (stat.st_mtime_ns, stat.st_size)
 
-    def _check_result_file(self, pdf_name: str, user_id: str, max_wait: int = 120) -> Optional[Path]:
+    def _check_result_file(self, pdf_name: str, user_id: str, existing: Dict[str, Tuple[int, int]] = None,
+                           max_wait: float = 120) -> Optional[Path]:
         """
-        检查Dify结果目录是否生成了txt结果文件。
-        只匹配pattern，不判断生成时间，只取mtime最新的文件返回。
+        检查Dify结果目录是否生成了本文档的txt结果文件。
+        Dify并发运行多个工作流，只匹配以本文档user_id命名、且相对工作流开始前的快照是新增或有变化的文件，
+        避免取到其他文档的结果或本文档上一次的旧结果。
         """
-        self.logger.info(f"🔍 检查Dify结果文件（不判断时间）...")
-        possible_patterns = [
-            f"user_{pdf_name}_response*.txt",
-            f"user_*{pdf_name}*.txt",
-            f"*{pdf_name}*response*.txt",
-            "*response*.txt",
-            f"{user_id}_response*.txt"
-        ]
-        for wait_count in range(max_wait):
+        existing = existing or {}
+        self.logger.info(f"🔍 检查Dify结果文件: {user_id}_response*.txt")
+        possible_patterns = [f"{user_id}_response*.txt"]
+        for wait_count in range(int(max_wait)):
             found = []
             for pattern in possible_patterns:
                 for f in Config.DIFY_RESULT_DIR.glob(pattern):
-                    if f.is_file():
+                    if f.is_file() and self._is_own_result(f, user_id, existing):
                         found.append(f)
             if found:
                 newest_file = max(found, key=lambda f: f.stat().st_mtime)
@@ -163,11 +271,11 @@ class DifyProcessor:
                 return newest_file
             if wait_count % 10 == 0 and wait_count > 0:
                 self.logger.info(f"⏳ 等待中... ({wait_count}s)")
-                self.logger.info(f"🔍 查找模式: {possible_patterns[:3]}")
+                self.logger.info(f"🔍 查找模式: {possible_patterns}")
                 all_files = sorted(Config.DIFY_RESULT_DIR.glob("*.txt"), key=lambda f: f.stat().st_mtime, reverse=True)[:5]
                 for rf in all_files:
                     rf_mtime = datetime.fromtimestamp(rf.stat().st_mtime)
                     self.logger.info(f"   {rf.name} ({rf_mtime})")
-            time.sleep(1)
-        self.logger.warning("❌ 等待超时也没找到任何txt文件")
+            self.cancel_token.wait(1, "Dify结果等待")
+        self.logger.warning(f"❌ 等待超时也没找到 {pdf_name} 的txt结果文件")
         return None
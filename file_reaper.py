@@ -0,0 +1,80 @@
+# file_reaper.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from config import Config
+
+
+class MistralFileReaper:
+    """后台清理Mistral上传文件，把files.delete移出OCR关键路径，失败时按退避重试。"""
+
+    def __init__(self, client, max_attempts: int = None, retry_delay: float = None):
+        self.client = client
+        self.max_attempts = max_attempts or Config.REAPER_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay is not None else Config.REAPER_RETRY_DELAY
+        self.logger = logging.getLogger(f"{__name__}.MistralFileReaper")
+        self.cond = threading.Condition()
+        self._pending = []  # (执行时间, 序号, file_id, 已尝试次数)
+        self._counter = itertools.count()
+        self._closed = False
+        self.failed = []
+        self._thread = threading.Thread(target=self._run, name="mistral-file-reaper", daemon=True)
+        self._thread.start()
+
+    def submit(self, file_id: str):
+        with self.cond:
+            closed = self._closed
+            if not closed:
+                heapq.heappush(self._pending, (time.monotonic(), next(self._counter), file_id, 0))
+                self.cond.notify()
+        if closed:
+            # 已停止的清理线程不会再处理，直接在调用线程中删除
+            try:
+                self.client.files.delete(file_id=file_id)
+            except Exception as e:
+                self.logger.warning(f"清理上传文件失败 {file_id}: {e}")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self._pending:
+                        if self._closed:
+                            return
+                        self.cond.wait()
+                        continue
+                    due = self._pending[0][0] - time.monotonic()
+                    if due <= 0:
+                        break
+                    self.cond.wait(due)
+                _, _, file_id, attempts = heapq.heappop(self._pending)
+
+            try:
+                self.client.files.delete(file_id=file_id)
+                self.logger.debug(f"清理上传文件: {file_id}")
+            except Exception as e:
+                attempts += 1
+                if attempts < self.max_attempts:
+                    delay = self.retry_delay * (2 ** (attempts - 1))
+                    self.logger.warning(f"清理上传文件失败 {file_id}（第{attempts}次），{delay:.1f}s后重试: {e}")
+                    with self.cond:
+                        heapq.heappush(self._pending, (time.monotonic() + delay, next(self._counter), file_id, attempts))
+                else:
+                    self.logger.error(f"清理上传文件最终失败 {file_id}: {e}")
+                    with self.cond:
+                        self.failed.append(file_id)
+
+    def close(self, timeout: float = 30):
+        """等待待清理文件处理完毕后停止后台线程。"""
+        with self.cond:
+            self._closed = True
+            self.cond.notify_all()
+        self._thread.join(timeout)
+        with self.cond:
+            remaining = [item[2] for item in self._pending]
+        if remaining:
+            self.logger.warning(f"⚠️ {len(remaining)} 个上传文件未能清理: {remaining}")
+        return remaining + self.failed
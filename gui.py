@@ -3,26 +3,49 @@ from tkinter import filedialog, messagebox, ttk
 from pathlib import Path
 import threading
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from config import Config
 from tracker import ProcessingTracker
-from ocr_processor import PDFProcessor
-from dify_processor import DifyProcessor
-from utils import open_dir, open_file
+from ocr_processor import build_processor
+from image_optimizer import PIL_AVAILABLE
+from batch_ocr import BatchOCRRunner, MistralBatchClient
+from dify_cache import DifyResultCache
+from cancellation import CancelToken, ProcessingCancelled
+from scheduler import JobScheduler, POLICIES
+from work_queue import SharedWorkQueue, run_worker, host_excel_path
+from search_index import MarkdownSearchIndex
+from stats import ProcessingStats, STAGES, format_duration
+from retry import RETRY_STAGES, RetryableFailure
+from utils import open_dir, open_file, LOG_FILE
 
 class PDFProcessorGUI:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("PDF文件批量处理器 - 增强调试版本")
-        self.root.geometry("950x750")
+        self.root.geometry("950x850")
 
         self.selected_files = []
+        self.high_priority_files = set()
+        self.scheduler = None
+        self.work_queue = None
         self.tracker = None
         self.processor = None
+        self.image_optimizer = None
+        self.file_reaper = None
+        self._reaper_closers = []
+        self.cancel_token = None
+        self.search_index = self._open_search_index()
+        self.stats = None
+        self._stats_job = None
+        self.permanent_failures = []
         self.processing = False
 
         self.setup_gui()
         self.setup_logging()
+        self._check_pending_batch()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_logging(self):
         logger = logging.getLogger(__name__)
@@ -81,7 +104,21 @@ class PDFProcessorGUI:
 
         ttk.Button(debug_frame, text="📁 打开Dify结果目录", command=self.open_dify_result_dir).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(debug_frame, text="📋 查看日志文件", command=self.open_log_file).pack(side=tk.LEFT, padx=(0, 10))
-        ttk.Button(debug_frame, text="🔄 检查Docker映射", command=self.check_docker_mapping).pack(side=tk.LEFT)
+        ttk.Button(debug_frame, text="🔄 检查Docker映射", command=self.check_docker_mapping).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(debug_frame, text="🗑️ 清除Dify缓存", command=self.clear_dify_cache).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(debug_frame, text="📊 导出合并台账", command=self.export_ledger,
+                   state='normal' if Config.WORK_QUEUE_DB else 'disabled').pack(side=tk.LEFT)
+
+        # 全文搜索
+        search_frame = ttk.Frame(status_frame)
+        search_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Label(search_frame, text="🔎 全文搜索:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=40)
+        search_entry.pack(side=tk.LEFT, padx=(10, 10))
+        search_entry.bind("<Return>", lambda event: self.search_markdown())
+        ttk.Button(search_frame, text="搜索", command=self.search_markdown,
+                   state='normal' if self.search_index else 'disabled').pack(side=tk.LEFT)
 
         # 处理选项
         options_frame = ttk.LabelFrame(main_frame, text="处理选项", padding="10")
@@ -96,9 +133,57 @@ class PDFProcessorGUI:
         )
         dify_check.pack(anchor=tk.W)
 
+        self.use_dify_cache_var = tk.BooleanVar(value=Config.DIFY_CACHE_ENABLED)
+        ttk.Checkbutton(
+            options_frame,
+            text="复用Dify缓存结果（Markdown内容未变化时跳过工作流；取消勾选则强制重新运行并刷新缓存）",
+            variable=self.use_dify_cache_var,
+            state='normal' if Config.DIFY_API_KEY else 'disabled'
+        ).pack(anchor=tk.W, pady=(5, 0))
+
         if not Config.DIFY_API_KEY:
             ttk.Label(options_frame, text="⚠️ 需要配置DIFY_API_KEY才能启用Dify功能", foreground="orange").pack(anchor=tk.W, pady=(5, 0))
 
+        self.recompress_images_var = tk.BooleanVar(value=Config.IMAGE_RECOMPRESS and PIL_AVAILABLE)
+        recompress_check = ttk.Checkbutton(
+            options_frame,
+            text=f"启用图片压缩（转为{Config.IMAGE_FORMAT.upper()}，质量{Config.IMAGE_QUALITY}，最长边≤{Config.IMAGE_MAX_DIM}px）",
+            variable=self.recompress_images_var,
+            state='normal' if PIL_AVAILABLE else 'disabled'
+        )
+        recompress_check.pack(anchor=tk.W, pady=(5, 0))
+
+        if not PIL_AVAILABLE:
+            ttk.Label(options_frame, text="⚠️ 需要安装Pillow才能启用图片压缩", foreground="orange").pack(anchor=tk.W, pady=(5, 0))
+
+        policy_frame = ttk.Frame(options_frame)
+        policy_frame.pack(anchor=tk.W, pady=(5, 0))
+        ttk.Label(policy_frame, text="调度策略:").pack(side=tk.LEFT)
+        self.policy_var = tk.StringVar(value=POLICIES.get(Config.SCHEDULER_POLICY, POLICIES["fifo"]))
+        ttk.Combobox(
+            policy_frame,
+            textvariable=self.policy_var,
+            values=list(POLICIES.values()),
+            state='readonly',
+            width=28
+        ).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(policy_frame, text=f"并发数: {Config.MAX_WORKERS}（⭐高优先级文件总是最先处理）").pack(side=tk.LEFT, padx=(10, 0))
+
+        self.distributed_var = tk.BooleanVar(value=bool(Config.WORK_QUEUE_DB))
+        ttk.Checkbutton(
+            options_frame,
+            text=f"多机共享队列模式（队列: {Config.WORK_QUEUE_DB or '未配置WORK_QUEUE_DB'}，本机: {Config.HOST_ID}）",
+            variable=self.distributed_var,
+            state='normal' if Config.WORK_QUEUE_DB else 'disabled'
+        ).pack(anchor=tk.W, pady=(5, 0))
+
+        self.batch_mode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="使用Mistral批量OCR模式（适合大量文件，成本更低，但结果可能延迟数小时；可中断后恢复）",
+            variable=self.batch_mode_var
+        ).pack(anchor=tk.W, pady=(5, 0))
+
         # 文件选择和处理区域
         process_frame = ttk.Frame(main_frame)
         process_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -119,19 +204,28 @@ class PDFProcessorGUI:
         self.stop_button = ttk.Button(button_frame, text="⏹️ 停止处理", command=self.stop_processing, state='disabled')
         self.stop_button.grid(row=4, column=0, pady=(0, 8), sticky=tk.W)
 
+        self.resume_button = ttk.Button(button_frame, text="♻️ 恢复批量任务", command=self.resume_batch_jobs)
+        self.resume_button.grid(row=5, column=0, pady=(0, 8), sticky=tk.W)
+
+        ttk.Button(button_frame, text="⭐ 提升优先级", command=self.bump_priority).grid(row=6, column=0, pady=(0, 8), sticky=tk.W)
+        ttk.Button(button_frame, text="🔁 清除所选Dify缓存", command=self.invalidate_selected_dify_cache).grid(
+            row=7, column=0, pady=(0, 8), sticky=tk.W)
+
         # 文件列表
         list_frame = ttk.LabelFrame(process_frame, text="选择的文件", padding="10")
         list_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
         list_frame.columnconfigure(0, weight=1)
         list_frame.rowconfigure(0, weight=1)
 
-        self.tree = ttk.Treeview(list_frame, columns=('name', 'size', 'status'), show='headings')
+        self.tree = ttk.Treeview(list_frame, columns=('name', 'size', 'priority', 'status'), show='headings')
         self.tree.heading('#1', text='文件名')
         self.tree.heading('#2', text='大小')
-        self.tree.heading('#3', text='状态')
-        self.tree.column('#1', width=350)
-        self.tree.column('#2', width=100)
-        self.tree.column('#3', width=200)
+        self.tree.heading('#3', text='优先级')
+        self.tree.heading('#4', text='状态')
+        self.tree.column('#1', width=300)
+        self.tree.column('#2', width=80)
+        self.tree.column('#3', width=60)
+        self.tree.column('#4', width=260)
 
         scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.tree.yview)
         self.tree.configure(yscrollcommand=scrollbar.set)
@@ -151,6 +245,23 @@ class PDFProcessorGUI:
         self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate')
         self.progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
 
+        # 实时统计：吞吐量、预计剩余时间、各阶段进行中数量和最近耗时
+        stats_frame = ttk.LabelFrame(progress_frame, text="📈 实时统计", padding="5")
+        stats_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        self.stats_summary_var = tk.StringVar(value="吞吐量: -- | 预计剩余: -- | 已用时: --")
+        ttk.Label(stats_frame, textvariable=self.stats_summary_var).grid(
+            row=0, column=0, columnspan=len(STAGES) + 1, sticky=tk.W, pady=(0, 5))
+        for row, text in enumerate(("阶段", "进行中", "p50", "p95"), start=1):
+            ttk.Label(stats_frame, text=text).grid(row=row, column=0, sticky=tk.W, padx=(0, 10))
+        self.stage_vars = {}
+        for column, (stage, label) in enumerate(STAGES.items(), start=1):
+            stats_frame.columnconfigure(column, weight=1)
+            ttk.Label(stats_frame, text=label).grid(row=1, column=column)
+            stage_vars = [tk.StringVar(value="--") for _ in range(3)]
+            for row, var in enumerate(stage_vars, start=2):
+                ttk.Label(stats_frame, textvariable=var).grid(row=row, column=column)
+            self.stage_vars[stage] = stage_vars
+
         # API配置警告
         if not Config.MISTRAL_API_KEY or not Config.DIFY_API_KEY:
             warning_frame = ttk.Frame(main_frame)
@@ -178,7 +289,7 @@ class PDFProcessorGUI:
 
     def open_log_file(self):
         try:
-            log_file = Path("pdf_processor_debug.log")
+            log_file = Path(LOG_FILE)
             if log_file.exists():
                 open_file(log_file)
             else:
@@ -186,6 +297,88 @@ class PDFProcessorGUI:
         except Exception as e:
             messagebox.showerror("错误", f"无法打开日志文件: {e}")
 
+    def clear_dify_cache(self):
+        if self.processing:
+            messagebox.showwarning("警告", "正在处理中，无法清除缓存")
+            return
+        if not messagebox.askyesno("确认", "确定要清除所有Dify缓存结果吗？\n清除后所有文档都会重新运行工作流。"):
+            return
+        try:
+            count = DifyResultCache().clear()
+            messagebox.showinfo("信息", f"已清除 {count} 条Dify缓存")
+        except Exception as e:
+            messagebox.showerror("错误", f"清除缓存失败: {e}")
+
+    def invalidate_selected_dify_cache(self):
+        """清除所选文件的Dify缓存，下次处理时这些文件重新运行工作流，其他文件仍使用缓存。"""
+        if self.processing:
+            messagebox.showwarning("警告", "正在处理中，无法清除缓存")
+            return
+        selection = self.tree.selection()
+        if not selection:
+            messagebox.showinfo("提示", "请先在文件列表中选择要重新运行Dify的文件")
+            return
+        try:
+            cache = DifyResultCache()
+            count = sum(cache.invalidate(Path(iid).stem) for iid in selection)
+        except Exception as e:
+            messagebox.showerror("错误", f"清除缓存失败: {e}")
+            return
+        logging.getLogger(__name__).info(f"🗑️ 已清除 {len(selection)} 个文件的Dify缓存: {count} 条")
+        messagebox.showinfo("信息", f"已清除 {len(selection)} 个文件的Dify缓存（{count} 条）")
+
+    def _open_search_index(self):
+        if not Config.SEARCH_INDEX_ENABLED:
+            return None
+        try:
+            index = MarkdownSearchIndex()
+            return index if index.available else None
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ 打开全文索引失败: {e}")
+            return None
+
+    def search_markdown(self):
+        query = self.search_var.get().strip()
+        if not query or not self.search_index:
+            return
+        try:
+            self.search_index.flush()
+            started = time.perf_counter()
+            hits = self.search_index.search(query)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            messagebox.showerror("错误", f"搜索失败: {e}")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"搜索: {query} - {len(hits)} 条结果 ({elapsed_ms:.0f}ms)")
+        window.geometry("800x400")
+        tree = ttk.Treeview(window, columns=("doc", "page", "snippet"), show="headings")
+        tree.heading("doc", text="文档")
+        tree.heading("page", text="页码")
+        tree.heading("snippet", text="内容片段")
+        tree.column("doc", width=200)
+        tree.column("page", width=50, anchor=tk.CENTER)
+        tree.column("snippet", width=530)
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        md_paths = {}
+        for hit in hits:
+            iid = tree.insert("", tk.END, values=(hit["doc"], hit["page"], hit["snippet"]))
+            md_paths[iid] = hit["md_path"]
+
+        def open_selected(event):
+            selection = tree.selection()
+            if selection:
+                try:
+                    open_file(Path(md_paths[selection[0]]))
+                except Exception as e:
+                    messagebox.showerror("错误", f"无法打开文件: {e}", parent=window)
+
+        tree.bind("<Double-1>", open_selected)
+
     def check_docker_mapping(self):
         try:
             Config.DIFY_RESULT_DIR.mkdir(parents=True, exist_ok=True)
@@ -224,6 +417,7 @@ class PDFProcessorGUI:
             messagebox.showwarning("警告", "正在处理中，无法清空列表")
             return
         self.selected_files.clear()
+        self.high_priority_files.clear()
         self.update_file_list()
 
     def update_file_list(self):
@@ -235,7 +429,8 @@ class PDFProcessorGUI:
                 size_str = f"{size_mb:.1f} MB"
             except Exception:
                 size_str = "未知"
-            self.tree.insert('', 'end', values=(file_path.name, size_str, "⏳ 待处理"))
+            priority = "⭐" if file_path in self.high_priority_files else ""
+            self.tree.insert('', 'end', iid=str(file_path), values=(file_path.name, size_str, priority, "⏳ 待处理"))
         count = len(self.selected_files)
         if count == 0:
             self.progress_var.set("🎯 请选择PDF文件")
@@ -244,15 +439,26 @@ class PDFProcessorGUI:
 
     def update_file_status(self, file_path: Path, status: str):
         try:
-            for item in self.tree.get_children():
-                values = self.tree.item(item)['values']
-                if values[0] == file_path.name:
-                    self.tree.item(item, values=(values[0], values[1], status))
-                    break
+            if self.tree.exists(str(file_path)):
+                self.tree.set(str(file_path), 'status', status)
             self.root.update_idletasks()
         except Exception:
             pass
 
+    def bump_priority(self):
+        selection = self.tree.selection()
+        if not selection:
+            messagebox.showinfo("提示", "请先在文件列表中选择要优先处理的文件")
+            return
+        for iid in selection:
+            file_path = Path(iid)
+            self.high_priority_files.add(file_path)
+            self.tree.set(iid, 'priority', "⭐")
+            if self.scheduler and self.scheduler.bump(file_path):
+                logging.getLogger(__name__).info(f"⭐ 提升优先级: {file_path.name}")
+            if self.work_queue and self.work_queue.bump(file_path):
+                logging.getLogger(__name__).info(f"⭐ 提升共享队列优先级: {file_path.name}")
+
     def start_processing(self):
         if not self.selected_files:
             messagebox.showwarning("警告", "请先选择PDF文件！")
@@ -283,14 +489,100 @@ class PDFProcessorGUI:
         self.progress_bar['maximum'] = len(self.selected_files)
         self.progress_bar['value'] = 0
         try:
-            self.tracker = ProcessingTracker(Config.EXCEL_PATH)
-            from mistralai import Mistral
-            client = Mistral(api_key=Config.MISTRAL_API_KEY)
-            dify_processor = None
-            if enable_dify and Config.DIFY_API_KEY:
-                dify_processor = DifyProcessor(self.tracker)
-            self.processor = PDFProcessor(client, self.tracker, dify_processor)
-            threading.Thread(target=self._process_files, args=(enable_dify,), daemon=True).start()
+            batch_mode = self.batch_mode_var.get()
+            distributed = self.distributed_var.get() and not batch_mode
+            client = self._create_processor(enable_dify, distributed)
+            policy = next(k for k, v in POLICIES.items() if v == self.policy_var.get())
+            self.scheduler = None
+            self.work_queue = None
+            if batch_mode:
+                runner = BatchOCRRunner(self.processor, MistralBatchClient(client))
+                threading.Thread(target=self._process_files_batch,
+                                 args=(runner, list(self.selected_files), enable_dify), daemon=True).start()
+            elif distributed:
+                self.work_queue = SharedWorkQueue(policy=policy)
+                threading.Thread(target=self._process_files_distributed, args=(enable_dify,), daemon=True).start()
+            else:
+                self.scheduler = JobScheduler(policy)
+                threading.Thread(target=self._process_files, args=(enable_dify,), daemon=True).start()
+        except Exception as e:
+            messagebox.showerror("错误", f"初始化处理器失败：{e}")
+            self.processing = False
+            self.start_button.config(state='normal')
+            self.stop_button.config(state='disabled')
+
+    def _create_processor(self, enable_dify: bool, distributed: bool = False):
+        self.tracker = ProcessingTracker(host_excel_path() if distributed else Config.EXCEL_PATH)
+        from mistralai import Mistral
+        client = Mistral(api_key=Config.MISTRAL_API_KEY)
+        self.cancel_token = CancelToken()
+        self.stats = ProcessingStats(len(self.selected_files))
+        self.permanent_failures = []
+        self.processor = build_processor(client, self.tracker, self.cancel_token, enable_dify,
+                                         self.use_dify_cache_var.get(), self.recompress_images_var.get(),
+                                         self.search_index, self.stats)
+        self.image_optimizer = self.processor.image_optimizer
+        self.file_reaper = self.processor.file_reaper
+        self._refresh_stats()
+        return client
+
+    def _refresh_stats(self):
+        if self._stats_job:
+            self.root.after_cancel(self._stats_job)
+            self._stats_job = None
+        if not self.stats:
+            return
+        snapshot = self.stats.snapshot()
+        self.stats_summary_var.set(
+            f"吞吐量: {snapshot['per_minute']:.1f} 个/分钟 | "
+            f"预计剩余: {format_duration(snapshot['eta'])} | "
+            f"已用时: {format_duration(snapshot['elapsed'])} | "
+            f"完成: {snapshot['done']}/{snapshot['total']}"
+        )
+        for stage, (in_flight_var, p50_var, p95_var) in self.stage_vars.items():
+            stage_stats = snapshot["stages"][stage]
+            in_flight_var.set(str(stage_stats["in_flight"]))
+            p50_var.set(format_duration(stage_stats["p50"]))
+            p95_var.set(format_duration(stage_stats["p95"]))
+        if self.processing:
+            self._stats_job = self.root.after(Config.STATS_REFRESH_MS, self._refresh_stats)
+
+    def _check_pending_batch(self):
+        try:
+            pending = BatchOCRRunner(None, None).pending_documents()
+        except Exception:
+            return
+        if pending:
+            self.progress_var.set(f"♻️ 发现 {len(pending)} 个未完成的批量OCR文件，可点击“恢复批量任务”继续")
+
+    def resume_batch_jobs(self):
+        if not Config.MISTRAL_API_KEY:
+            messagebox.showerror("错误", "未配置Mistral API密钥！\n请在.env文件中设置MISTRAL_API_KEY")
+            return
+        if self.processing:
+            messagebox.showinfo("提示", "正在处理中，请稍候...")
+            return
+        pending = BatchOCRRunner(None, None).pending_documents()
+        if not pending:
+            messagebox.showinfo("提示", "没有未完成的批量OCR任务")
+            return
+        if not messagebox.askyesno("确认", f"发现 {len(pending)} 个未完成的批量OCR文件，是否继续等待并处理结果？"):
+            return
+        for path in pending:
+            if path not in self.selected_files:
+                self.selected_files.append(path)
+        self.update_file_list()
+        self.processing = True
+        self.start_button.config(state='disabled')
+        self.stop_button.config(state='normal')
+        self.progress_bar['value'] = 0
+        try:
+            # 恢复的任务各自记录了是否启用Dify，这里只要有密钥就准备好Dify处理器
+            client = self._create_processor(bool(Config.DIFY_API_KEY))
+            self.scheduler = None
+            self.work_queue = None
+            runner = BatchOCRRunner(self.processor, MistralBatchClient(client))
+            threading.Thread(target=self._process_files_batch, args=(runner, [], False), daemon=True).start()
         except Exception as e:
             messagebox.showerror("错误", f"初始化处理器失败：{e}")
             self.processing = False
@@ -300,59 +592,309 @@ class PDFProcessorGUI:
     def stop_processing(self):
         if messagebox.askyesno("确认", "确定要停止处理吗？"):
             self.processing = False
+            if self.cancel_token:
+                self.cancel_token.cancel()
+            if self.scheduler:
+                # 唤醒正在等待重试的工作线程
+                self.scheduler.close()
             self.progress_var.set("🛑 用户停止处理")
 
     def _process_files(self, enable_dify: bool):
         logger = logging.getLogger(__name__)
         try:
-            total_files = len(self.selected_files)
-            success_count = 0
+            files = list(self.selected_files)
+            total_files = len(files)
             logger.info(f"🚀 开始批量处理 {total_files} 个PDF文件")
             logger.info(f"🔧 Dify处理: {'启用' if enable_dify else '禁用'}")
-            for i, file_path in enumerate(self.selected_files):
-                if not self.processing:
-                    logger.info(f"⏹️ 用户停止处理，已处理 {i} 个文件")
-                    break
-                logger.info(f"📄 开始处理第 {i + 1}/{total_files} 个文件: {file_path.name}")
-                self.root.after(0, self.update_file_status, file_path, "🔄 OCR处理中...")
-                self.root.after(0, self.progress_var.set, f"🔄 正在处理: {file_path.name} ({i + 1}/{total_files})")
+            logger.info(f"📐 调度策略: {POLICIES[self.scheduler.policy]}, 并发数: {Config.MAX_WORKERS}")
+            self.root.after(0, self.progress_var.set, f"📐 正在估算 {total_files} 个文件的处理成本...")
+            self.scheduler.add(files, self.high_priority_files)
+
+            counters = {"done": 0, "success": 0}
+            counter_lock = threading.Lock()
+
+            def worker():
+                while self.processing:
+                    job = self.scheduler.get()
+                    if job is None:
+                        return
+                    self._process_job(job, enable_dify, counters, counter_lock, total_files)
+
+            with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS, thread_name_prefix="pdf-worker") as pool:
+                for _ in range(Config.MAX_WORKERS):
+                    pool.submit(worker)
+
+            if not self.processing:
+                logger.info(f"⏹️ 用户停止处理，已处理 {counters['done']} 个文件")
+            logger.info(f"🏁 批量处理完成: 成功 {counters['success']}/{total_files}")
+            logger.info(f"⏱️ {self.scheduler.summary()}")
+            self.root.after(0, self._processing_completed, counters["success"], total_files)
+        except Exception as e:
+            logger.error(f"💥 处理过程严重异常: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            self.root.after(0, messagebox.showerror, "严重错误", f"处理过程中出错: {e}")
+            self.root.after(0, self._processing_completed, 0, len(self.selected_files))
+
+    def _process_job(self, job, enable_dify: bool, counters: dict, counter_lock, total_files: int):
+        logger = logging.getLogger(__name__)
+        file_path = job.path
+        state = job.retry_state
+        logger.info(f"📄 开始处理: {file_path.name}（排队 {job.queue_wait:.1f}s，估算成本 {job.cost:.0f}）")
+        self.root.after(0, self.update_file_status, file_path,
+                        "🔄 Dify重试中..." if state.stage == "dify" else "🔄 OCR处理中...")
+        success = False
+        try:
+            if state.stage == "dify":
+                success = self.processor.resume_dify(file_path, state)
+            else:
+                success = self.processor.process_pdf(file_path, enable_dify, state)
+            if success and not state.failed_stage:
+                status = "✅ 处理完成"
+                logger.info(f"✅ 文件处理成功: {file_path.name}")
+            elif success:
+                status = "⚠️ OCR完成，Dify失败"
+                logger.error(f"❌ Dify处理失败: {file_path.name}")
+            else:
+                status = "❌ 处理失败"
+                logger.error(f"❌ 文件处理失败: {file_path.name}")
+        except RetryableFailure as e:
+            delay = state.next_delay()
+            logger.warning(f"⏳ {e}，{delay:.0f}s后重试: {file_path.name}")
+            self.scheduler.retry(job, delay)
+            self.root.after(0, self.update_file_status, file_path,
+                            f"⏳ {RETRY_STAGES[e.stage]}第{state.attempts[e.stage]}次失败，{delay:.0f}s后重试")
+            return
+        except ProcessingCancelled:
+            logger.info(f"⏹️ 用户停止处理，已中止: {file_path.name}")
+            self.scheduler.close()
+            self.root.after(0, self.update_file_status, file_path, "⏹️ 已取消")
+            return
+        except Exception as e:
+            logger.error(f"💥 处理文件异常 {file_path.name}: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            state.last_error = str(e)
+            state.failed_stage = state.stage
+            status = f"❌ 错误: {str(e)[:30]}"
+        self.scheduler.task_done(job)
+        self.stats.document_done()
+        self._record_failure(file_path.name, success, state)
+        status += f"（排队 {job.queue_wait:.0f}s / 完成 {job.latency:.0f}s）"
+        with counter_lock:
+            counters["done"] += 1
+            counters["success"] += int(bool(success))
+            done = counters["done"]
+        self.root.after(0, self.update_file_status, file_path, status)
+        self.root.after(0, self.progress_bar.config, {'value': done})
+        self.root.after(0, self.progress_var.set, f"🔄 已完成 {done}/{total_files}: {file_path.name}")
+
+    def _record_failure(self, name: str, success: bool, state):
+        """记录无法自动恢复的失败：有失败阶段的文档（包括OCR成功但Dify失败），以及其他未成功的文档。"""
+        if state.failed_stage:
+            self.permanent_failures.append((name, RETRY_STAGES[state.failed_stage], state.last_error))
+        elif not success:
+            self.permanent_failures.append((name, "处理", state.last_error or "处理失败，详见日志"))
+
+    def _process_files_distributed(self, enable_dify: bool):
+        logger = logging.getLogger(__name__)
+        try:
+            files = list(self.selected_files)
+            added = self.work_queue.enqueue(files, enable_dify, self.high_priority_files)
+            logger.info(f"🌐 已加入共享队列 {added}/{len(files)} 个文件（其余已在队列中），本机: {Config.HOST_ID}")
+            counts = self.work_queue.counts()
+            # 进度和吞吐量按共享队列中所有主机的完成数统计，与总数口径一致
+            finished_before = counts.get('done', 0) + counts.get('failed', 0)
+            counters = {"done": 0, "success": 0}
+            counter_lock = threading.Lock()
+            processed_here = set()
+            pool_done = threading.Event()
+
+            def sync_stats():
                 try:
-                    success = self.processor.process_pdf(file_path, enable_dify)
-                    if success:
-                        success_count += 1
-                        status = "✅ 处理完成"
-                        logger.info(f"✅ 文件处理成功: {file_path.name}")
-                    else:
-                        status = "❌ 处理失败"
-                        logger.error(f"❌ 文件处理失败: {file_path.name}")
-                    self.root.after(0, self.update_file_status, file_path, status)
+                    counts = self.work_queue.counts()
                 except Exception as e:
-                    logger.error(f"💥 处理文件异常 {file_path.name}: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-                    self.root.after(0, self.update_file_status, file_path, f"❌ 错误: {str(e)[:30]}")
-                self.root.after(0, self.progress_bar.config, {'value': i + 1})
-            logger.info(f"🏁 批量处理完成: 成功 {success_count}/{total_files}")
-            self.root.after(0, self._processing_completed, success_count, total_files)
+                    logger.warning(f"刷新共享队列进度失败: {e}")
+                    return
+                finished = counts.get('done', 0) + counts.get('failed', 0) - finished_before
+                total = finished + counts.get('pending', 0) + counts.get('claimed', 0)
+                self.stats.sync_done(finished, total)
+                self.root.after(0, self.progress_bar.config, {'maximum': max(total, 1), 'value': finished})
+
+            def sync_stats_loop():
+                # 本机没有文档完成时也能看到其他主机的进度
+                while not pool_done.wait(5):
+                    sync_stats()
+
+            sync_stats()
+            threading.Thread(target=sync_stats_loop, name="queue-stats", daemon=True).start()
+
+            def on_start(job):
+                self.root.after(0, self.update_file_status, job.path, f"🔄 OCR处理中（第{job.attempts}次）...")
+
+            def on_retry(job, error, delay):
+                self.root.after(0, self.update_file_status, job.path,
+                                f"⏳ {RETRY_STAGES[error.stage]}第{job.retry_state.attempts[error.stage]}次失败，"
+                                f"{delay:.0f}s后重试")
+
+            def on_done(job, success):
+                self._record_failure(job.path.name, success, job.retry_state)
+                with counter_lock:
+                    counters["done"] += 1
+                    counters["success"] += int(success)
+                    processed_here.add(self.work_queue.key(job.path))
+                    done = counters["done"]
+                sync_stats()
+                self.root.after(0, self.update_file_status, job.path, "✅ 处理完成" if success else "❌ 处理失败")
+                self.root.after(0, self.progress_var.set, f"🌐 本机已完成 {done} 个文件: {job.path.name}")
+
+            should_stop = lambda: not self.processing
+            try:
+                with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS, thread_name_prefix="queue-worker") as pool:
+                    futures = [pool.submit(run_worker, self.work_queue, self.processor, should_stop,
+                                           on_start, on_done, on_retry)
+                               for _ in range(Config.MAX_WORKERS)]
+            finally:
+                pool_done.set()
+            sync_stats()
+            for future in futures:
+                try:
+                    future.result()
+                except ProcessingCancelled:
+                    pass
+
+            statuses = self.work_queue.status_of(files)
+            for file_path in files:
+                key = self.work_queue.key(file_path)
+                if key in processed_here:
+                    continue
+                if statuses.get(key) == 'claimed':
+                    self.root.after(0, self.update_file_status, file_path, "🌐 其他主机处理中")
+                elif statuses.get(key) in ('done', 'failed'):
+                    self.root.after(0, self.update_file_status, file_path, "🌐 已由其他主机处理")
+            logger.info(f"🏁 本机处理完成: 成功 {counters['success']}/{counters['done']}，"
+                        f"共享队列状态: {self.work_queue.counts()}")
+            self.root.after(0, self._processing_completed, counters["success"], counters["done"])
         except Exception as e:
-            logger.error(f"💥 处理过程严重异常: {e}")
+            logger.error(f"💥 共享队列处理异常: {e}")
             import traceback
             logger.error(traceback.format_exc())
             self.root.after(0, messagebox.showerror, "严重错误", f"处理过程中出错: {e}")
             self.root.after(0, self._processing_completed, 0, len(self.selected_files))
 
+    def export_ledger(self):
+        if not self.work_queue and not Config.WORK_QUEUE_DB:
+            messagebox.showwarning("提示", "未配置WORK_QUEUE_DB，没有共享队列台账可导出")
+            return
+        try:
+            queue = self.work_queue or SharedWorkQueue()
+            excel_path = Config.EXCEL_PATH.with_name(f"{Config.EXCEL_PATH.stem}_merged{Config.EXCEL_PATH.suffix}")
+            count = queue.export_ledger(excel_path)
+            messagebox.showinfo("信息", f"已导出 {count} 条合并记录到:\n{excel_path}")
+        except Exception as e:
+            messagebox.showerror("错误", f"导出合并台账失败: {e}")
+
+    def _process_files_batch(self, runner: BatchOCRRunner, files: list, enable_dify: bool):
+        logger = logging.getLogger(__name__)
+        try:
+            pending = runner.pending_documents()
+            total_files = len(pending) + len([f for f in files if f not in pending])
+            done = []
+            logger.info(f"📦 批量OCR模式: 新文件 {len(files)} 个, 待恢复 {len(pending)} 个")
+            self.stats.set_total(total_files)
+            self.root.after(0, self.progress_bar.config, {'maximum': total_files})
+            for file_path in files:
+                self.root.after(0, self.update_file_status, file_path, "📦 上传中...")
+            self.root.after(0, self.progress_var.set, f"📦 正在上传并提交批量OCR任务 ({total_files} 个文件)")
+
+            def on_document_done(pdf_path, success, state):
+                done.append(pdf_path)
+                self.stats.document_done()
+                self._record_failure(pdf_path.name, success, state)
+                if success and not state.failed_stage:
+                    status = "✅ 处理完成"
+                elif success:
+                    status = "⚠️ OCR完成，Dify失败"
+                else:
+                    status = "❌ 处理失败"
+                self.root.after(0, self.update_file_status, pdf_path, status)
+                self.root.after(0, self.progress_bar.config, {'value': len(done)})
+                self.root.after(0, self.progress_var.set, f"📬 批量OCR结果处理中 ({len(done)}/{total_files})")
+
+            def on_upload_failed(pdf_path, state):
+                done.append(pdf_path)
+                self.stats.document_done()
+                self._record_failure(pdf_path.name, False, state)
+                self.root.after(0, self.update_file_status, pdf_path, "❌ 上传失败")
+                self.root.after(0, self.progress_bar.config, {'value': len(done)})
+
+            should_stop = lambda: not self.processing
+            runner.submit(files, enable_dify, should_stop, on_upload_failed)
+            submitted = runner.pending_documents()
+            for file_path in submitted:
+                self.root.after(0, self.update_file_status, file_path, "📦 批量OCR排队中")
+            self.root.after(0, self.progress_var.set, f"⏳ 等待批量OCR任务完成 ({len(submitted)} 个文件)")
+            success_count, done_count = runner.run([], enable_dify, on_document_done, should_stop)
+            remaining = runner.pending_documents()
+            if remaining:
+                logger.info(f"⏹️ 已停止等待，{len(remaining)} 个文件的批量任务已保存，可稍后恢复")
+                total_files = len(done)
+            logger.info(f"🏁 批量OCR处理完成: 成功 {success_count}/{total_files}")
+            self.root.after(0, self._processing_completed, success_count, total_files)
+        except Exception as e:
+            logger.error(f"💥 批量OCR处理异常: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            self.root.after(0, messagebox.showerror, "严重错误", f"批量处理过程中出错: {e}")
+            self.root.after(0, self._processing_completed, 0, len(files))
+
     def _processing_completed(self, success_count: int, total_files: int):
         self.processing = False
         self.start_button.config(state='normal')
         self.stop_button.config(state='disabled')
         failed_count = total_files - success_count
         self.progress_var.set(f"🎉 处理完成！成功: {success_count}, 失败: {failed_count}")
+        self._refresh_stats()
+        if self.stats:
+            stages = self.stats.snapshot()["stages"]
+            logging.getLogger(__name__).info("📈 阶段耗时 p50/p95: " + ", ".join(
+                f"{STAGES[stage]} {format_duration(v['p50'])}/{format_duration(v['p95'])}"
+                for stage, v in stages.items() if v["finished"]
+            ))
+        image_text = ""
+        if self.image_optimizer:
+            image_summary = self.image_optimizer.summary()
+            logging.getLogger(__name__).info(f"🗜️ 本批图片压缩: {image_summary}")
+            image_text = f"\n🗜️ 图片压缩：{image_summary}"
+            self.image_optimizer.shutdown()
+            self.image_optimizer = None
+        schedule_text = ""
+        if self.scheduler:
+            schedule_text = f"\n⏱️ {self.scheduler.summary()}"
+        failure_text = ""
+        if self.permanent_failures:
+            logger = logging.getLogger(__name__)
+            logger.error(f"❌ 永久失败 {len(self.permanent_failures)} 个文件:")
+            for name, stage, error in self.permanent_failures:
+                logger.error(f"   {name} [{stage}] {error}")
+            lines = [f"  • {name} [{stage}] {error[:60]}" for name, stage, error in self.permanent_failures[:10]]
+            if len(self.permanent_failures) > 10:
+                lines.append(f"  … 共 {len(self.permanent_failures)} 个，详见Excel“最后错误”列")
+            failure_text = "\n\n❌ 无法自动恢复的失败（临时错误已自动重试）：\n" + "\n".join(lines)
+        if self.file_reaper:
+            # 在后台等待清理完成，关闭窗口时会等待这些线程结束
+            closer = threading.Thread(target=self.file_reaper.close, daemon=True)
+            closer.start()
+            self._reaper_closers.append(closer)
+            self.file_reaper = None
+        if self.search_index:
+            self.search_index.flush()
         message = f"""🎉 处理完成！
 
 📊 处理结果：
 ✅ 成功：{success_count} 个文件
 ❌ 失败：{failed_count} 个文件
-📁 总计：{total_files} 个文件
+📁 总计：{total_files} 个文件{image_text}{schedule_text}{failure_text}
 
 📂 生成的文件：
 📝 Markdown：{Config.MD_OUT_DIR}
@@ -371,6 +913,28 @@ class PDFProcessorGUI:
         except Exception as e:
             messagebox.showerror("错误", f"无法打开目录: {e}")
 
+    def on_close(self):
+        """关闭窗口前等待上传文件清理完成，否则清理线程中排队的删除会随进程退出而丢失。"""
+        if self.processing:
+            if not messagebox.askyesno("确认", "正在处理中，确定要停止并退出吗？"):
+                return
+            self.processing = False
+            if self.cancel_token:
+                self.cancel_token.cancel()
+            if self.scheduler:
+                self.scheduler.close()
+        if self.file_reaper or any(closer.is_alive() for closer in self._reaper_closers):
+            self.progress_var.set("🧹 正在清理已上传的文件，请稍候...")
+            self.root.update_idletasks()
+        if self.file_reaper:
+            self.file_reaper.close()
+            self.file_reaper = None
+        for closer in self._reaper_closers:
+            closer.join()
+        if self.search_index:
+            self.search_index.flush()
+        self.root.destroy()
+
     def run(self):
         try:
             self.root.mainloop()
@@ -0,0 +1,139 @@
+# image_optimizer.py
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from config import Config
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+# 目标格式 -> (Pillow格式名, 文件扩展名)
+TARGET_FORMATS = {
+    "webp": ("WEBP", "webp"),
+    "jpg": ("JPEG", "jpg"),
+    "jpeg": ("JPEG", "jpg"),
+}
+
+
+def _recompress_image(path_str: str, target: str, quality: int, max_dim: int):
+    """
+    在子进程中重新编码单张图片。
+    返回 (原文件名, 新文件名, 原大小, 新大小)；压缩后反而更大时保留原图。
+    """
+    src = Path(path_str)
+    original_size = src.stat().st_size
+    pil_format, ext = TARGET_FORMATS[target]
+    dst = src.with_suffix(f".{ext}")
+    tmp = src.with_name(f"{src.stem}.tmp.{ext}")
+
+    with Image.open(src) as img:
+        img.load()
+        resized = False
+        if max_dim > 0 and max(img.size) > max_dim:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            resized = True
+        if pil_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif pil_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.mode or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+        img.save(tmp, format=pil_format, quality=quality, optimize=True)
+
+    new_size = tmp.stat().st_size
+    if new_size >= original_size and not resized:
+        tmp.unlink()
+        return src.name, src.name, original_size, original_size
+
+    tmp.replace(dst)
+    if dst != src:
+        src.unlink()
+    return src.name, dst.name, original_size, new_size
+
+
+class ImageOptimizer:
+    """OCR后的图片重新编码阶段，CPU密集的编码放在进程池中执行，避免与I/O线程争抢GIL。"""
+
+    def __init__(self, target_format: str = None, quality: int = None,
+                 max_dim: int = None, max_workers: int = None):
+        if not PIL_AVAILABLE:
+            raise RuntimeError("图片压缩需要安装Pillow: pip install pillow")
+        self.target_format = (target_format or Config.IMAGE_FORMAT).lower()
+        if self.target_format not in TARGET_FORMATS:
+            raise ValueError(f"不支持的图片压缩格式: {self.target_format}")
+        self.quality = quality if quality is not None else Config.IMAGE_QUALITY
+        self.max_dim = max_dim if max_dim is not None else Config.IMAGE_MAX_DIM
+        self.max_workers = max_workers or Config.IMAGE_WORKERS
+        self.logger = logging.getLogger(f"{__name__}.ImageOptimizer")
+        self.lock = threading.Lock()
+        self._pool = None
+        self.reset_stats()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def optimize(self, image_paths: List[Path]) -> Dict[str, str]:
+        """重新编码一篇文档的图片，返回 {原文件名: 新文件名} 供Markdown链接替换。"""
+        if not image_paths:
+            return {}
+        pool = self._get_pool()
+        futures = [
+            (path, pool.submit(_recompress_image, str(path), self.target_format,
+                               self.quality, self.max_dim))
+            for path in image_paths
+        ]
+        renamed = {}
+        original_total = new_total = errors = 0
+        for path, future in futures:
+            try:
+                old_name, new_name, original_size, new_size = future.result()
+            except Exception as e:
+                self.logger.error(f"图片压缩失败 {path.name}: {e}")
+                errors += 1
+                continue
+            original_total += original_size
+            new_total += new_size
+            if new_name != old_name:
+                renamed[old_name] = new_name
+
+        with self.lock:
+            self.stats["images"] += len(image_paths) - errors
+            self.stats["errors"] += errors
+            self.stats["original_bytes"] += original_total
+            self.stats["new_bytes"] += new_total
+
+        if original_total:
+            saved = 100 * (1 - new_total / original_total)
+            self.logger.info(f"🗜️ 图片压缩: {len(image_paths) - errors} 张, "
+                             f"{original_total / 1024:.0f}KB -> {new_total / 1024:.0f}KB (-{saved:.1f}%)")
+        return renamed
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"images": 0, "errors": 0, "original_bytes": 0, "new_bytes": 0}
+
+    def summary(self) -> str:
+        with self.lock:
+            stats = dict(self.stats)
+        original_mb = stats["original_bytes"] / (1024 * 1024)
+        new_mb = stats["new_bytes"] / (1024 * 1024)
+        saved = 100 * (1 - stats["new_bytes"] / stats["original_bytes"]) if stats["original_bytes"] else 0.0
+        text = f"{stats['images']} 张, {original_mb:.1f}MB -> {new_mb:.1f}MB (节省 {saved:.1f}%)"
+        if stats["errors"]:
+            text += f", 失败 {stats['errors']} 张"
+        return text
+
+    def shutdown(self):
+        with self.lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
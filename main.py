@@ -1,10 +1,106 @@
 # main.py
+import argparse
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+
 from gui import PDFProcessorGUI
-from utils import init_logging
+from utils import LOG_FILE, init_logging, worker_log_file
 from config import Config
 
+def run_worker_mode(args):
+    """无界面运行：从共享队列领取文档直到队列清空。可在多台机器、多个进程上同时运行。"""
+    from mistralai import Mistral
+    from tracker import ProcessingTracker
+    from ocr_processor import build_processor
+    from cancellation import CancelToken, ProcessingCancelled
+    from work_queue import SharedWorkQueue, run_worker, host_excel_path
+    from search_index import MarkdownSearchIndex
+
+    if not Config.WORK_QUEUE_DB:
+        print("❌ 未配置WORK_QUEUE_DB，无法以共享队列模式运行")
+        return
+    if not Config.MISTRAL_API_KEY:
+        print("❌ 未配置Mistral API密钥")
+        return
+
+    queue = SharedWorkQueue()
+    if args.enqueue:
+        pdf_files = [p for p in map(Path, args.enqueue) if p.is_file()]
+        added = queue.enqueue(pdf_files, enable_dify=args.dify)
+        print(f"🌐 已加入共享队列 {added}/{len(pdf_files)} 个文件")
+
+    tracker = ProcessingTracker(host_excel_path())
+    client = Mistral(api_key=Config.MISTRAL_API_KEY)
+    cancel_token = CancelToken()
+    search_index = MarkdownSearchIndex() if Config.SEARCH_INDEX_ENABLED else None
+    # 与界面使用相同的装配，Dify缓存和图片压缩按Config生效
+    processor = build_processor(client, tracker, cancel_token, search_index=search_index)
+
+    print(f"🌐 主机 {Config.HOST_ID} 开始处理共享队列: {Config.WORK_QUEUE_DB}（并发数 {Config.MAX_WORKERS}）")
+    stop = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS, thread_name_prefix="queue-worker") as pool:
+            futures = [pool.submit(run_worker, queue, processor, stop.is_set) for _ in range(Config.MAX_WORKERS)]
+            for future in futures:
+                while True:
+                    try:
+                        future.result(timeout=1)
+                        break
+                    except TimeoutError:
+                        continue
+                    except ProcessingCancelled:
+                        break
+                    except KeyboardInterrupt:
+                        print("⏹️ 正在停止，未完成的文档将退回队列...")
+                        stop.set()
+                        cancel_token.cancel()
+                    except Exception:
+                        # 一个工作线程异常退出时停止其他线程，避免清理前进程被异常中断
+                        stop.set()
+                        cancel_token.cancel()
+                        raise
+    finally:
+        # 无论是否异常都要等待上传文件清理完成并提交全文索引
+        processor.file_reaper.close()
+        if processor.image_optimizer:
+            print(f"🗜️ 图片压缩: {processor.image_optimizer.summary()}")
+            processor.image_optimizer.shutdown()
+        if search_index:
+            search_index.flush()
+    print(f"🏁 共享队列状态: {queue.counts()}")
+
+
 def main():
-    init_logging()
+    parser = argparse.ArgumentParser(description="PDF批量处理器")
+    parser.add_argument("--worker", action="store_true", help="无界面运行，处理共享队列（需要配置WORK_QUEUE_DB）")
+    parser.add_argument("--worker-id", type=int, default=0, metavar="N",
+                        help="同一台机器运行多个--worker进程时各自使用不同编号，决定日志文件名")
+    parser.add_argument("--enqueue", nargs="+", metavar="PDF", help="以--worker运行前先把这些PDF加入共享队列")
+    parser.add_argument("--dify", action="store_true", help="加入队列的文件在OCR后进行Dify处理")
+    parser.add_argument("--export-ledger", metavar="XLSX", help="导出共享队列的合并台账后退出")
+    parser.add_argument("--search", metavar="QUERY", help="在已生成的Markdown全文索引中搜索后退出")
+    args = parser.parse_args()
+
+    init_logging(worker_log_file(args.worker_id) if args.worker else LOG_FILE)
+    if args.export_ledger:
+        if not Config.WORK_QUEUE_DB:
+            print("❌ 未配置WORK_QUEUE_DB，无法导出共享队列台账")
+            return
+        from work_queue import SharedWorkQueue
+        count = SharedWorkQueue().export_ledger(Path(args.export_ledger))
+        print(f"📊 已导出 {count} 条合并记录: {args.export_ledger}")
+        return
+    if args.search:
+        from search_index import MarkdownSearchIndex
+        for hit in MarkdownSearchIndex().search(args.search):
+            print(f"📄 {hit['doc']} 第{hit['page']}页: {hit['snippet']}")
+        return
+    if args.worker:
+        run_worker_mode(args)
+        return
+
     print("=" * 80)
     print("🚀 PDF批量处理器 - 增强调试版本启动")
     print("=" * 80)
@@ -39,4 +135,6 @@ def main():
         input("按Enter键退出...")
 
 if __name__ == '__main__':
+    # 打包为exe（pyinstaller）时，图片压缩进程池的子进程会重新执行本入口，必须先交给multiprocessing处理
+    multiprocessing.freeze_support()
     main()
@@ -1,110 +1,245 @@
 # ocr_processor.py
 import json
 import base64
+import hashlib
 from pathlib import Path
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from mistralai import Mistral, DocumentURLChunk, FileTypedDict
 from config import Config
+from utils import HashingReader
+from cancellation import CancelToken, ProcessingCancelled, StageTimeout
+from stats import ProcessingStats
+from retry import RetryableFailure, RetryState, is_transient
+from dify_processor import DifyProcessor
+from dify_cache import DifyResultCache
+from image_optimizer import ImageOptimizer, PIL_AVAILABLE
+from file_reaper import MistralFileReaper
 
 class PDFProcessor:
-    def __init__(self, client: Mistral, tracker, dify_processor=None):
+    def __init__(self, client: Mistral, tracker, dify_processor=None, image_optimizer=None,
+                 file_reaper=None, cancel_token: CancelToken = None, search_index=None,
+                 stats: ProcessingStats = None):
         import logging
         self.client = client
         self.tracker = tracker
         self.dify_processor = dify_processor
+        self.image_optimizer = image_optimizer
+        self.file_reaper = file_reaper
+        self.cancel_token = cancel_token or CancelToken()
+        self.search_index = search_index
+        self.stats = stats or ProcessingStats()
         self.logger = logging.getLogger(__name__)
 
-    def process_pdf(self, pdf_path: Path, enable_dify: bool = False):
+    def process_pdf(self, pdf_path: Path, enable_dify: bool = False, retry_state: RetryState = None):
+        """
+        retry_state 由调用方的队列保存；传入时临时性错误会抛出 RetryableFailure，
+        由调用方退避后重新入队。永久性错误或重试次数用完时记录失败并返回False。
+        """
         pdf_name = pdf_path.name
-        stem = pdf_path.stem
-        self.logger.info(f"开始处理: {pdf_name}")
-        self.tracker.update_record(pdf_name, note='正在OCR处理...')
+        state = retry_state or RetryState()
+        attempt = state.begin("ocr")
+        self.logger.info(f"开始处理: {pdf_name}" + (f"（OCR第{attempt}次尝试）" if attempt > 1 else ""))
+        self.tracker.update_record(pdf_name, note='正在OCR处理...', ocr_attempts=attempt)
         try:
-            ocr_result = self._upload_and_ocr(pdf_path)
-            img_count = self._save_images(ocr_result, stem)
-            md_path = self._save_markdown(ocr_result, stem)
+            with self.stats.stage("ocr"):
+                ocr_result, file_hash = self._upload_and_ocr(pdf_path)
+            self.tracker.update_record(pdf_name, file_hash=file_hash)
+            return self.process_ocr_result(pdf_path, ocr_result, enable_dify, retry_state)
 
-            has_md = md_path and md_path.exists()
-            has_images = img_count > 0
+        except ProcessingCancelled as e:
+            self.logger.info(f"⏹️ 处理已取消 {pdf_name}: {e}")
+            self.tracker.update_record(pdf_name, note=f"⏹️ {e}")
+            raise
+        except RetryableFailure:
+            raise
+        except StageTimeout as e:
+            return self._ocr_failed(pdf_name, f"⏱️ OCR超时: {e}", e, state, retry_state is not None)
+        except Exception as e:
+            return self._ocr_failed(pdf_name, f"OCR错误: {e}", e, state, retry_state is not None)
 
-            if has_md and has_images:
-                note = "OCR完成"
-            else:
-                missing = []
-                if not has_md: missing.append("MD")
-                if not has_images: missing.append("图片")
-                note = f"OCR部分缺失: {', '.join(missing)}"
-
-            self.tracker.update_record(
-                pdf_name,
-                has_md=has_md,
-                has_images=has_images,
-                image_count=img_count,
-                note=note
-            )
+    def _ocr_failed(self, pdf_name: str, note: str, error: Exception, state: RetryState, retryable: bool) -> bool:
+        transient = is_transient(error)
+        state.last_error = f"OCR: {error}"
+        if retryable and transient and state.can_retry("ocr"):
+            self.logger.warning(f"⏳ OCR临时错误，稍后重试 {pdf_name}（第{state.attempts['ocr']}次）: {error}")
+            self.tracker.update_record(pdf_name, note=f"⏳ {note}（将重试）", last_error=state.last_error)
+            raise RetryableFailure("ocr", str(error)) from error
+        state.failed_stage = "ocr"
+        self.logger.error(f"❌ 处理失败 {pdf_name}: {error}")
+        if transient and retryable:
+            note += f"（已重试{state.attempts['ocr']}次）"
+        self.tracker.update_record(pdf_name, note=note, last_error=state.last_error)
+        return False
 
-            if enable_dify and has_md and self.dify_processor:
-                self.logger.info(f"开始Dify处理: {pdf_name}")
-                self.tracker.update_record(pdf_name, note="开始Dify处理...")
+    def process_ocr_result(self, pdf_path: Path, ocr_result: dict, enable_dify: bool = False,
+                           retry_state: RetryState = None, retryable: bool = None):
+        """
+        保存图片和Markdown，按需进行Dify处理。同步OCR和批量OCR的结果都从这里汇入。
+        retryable 默认在传入 retry_state 时为True；批量OCR没有重新入队的机制，传入False只记录失败阶段。
+        """
+        if retryable is None:
+            retryable = retry_state is not None
+        pdf_name = pdf_path.name
+        stem = pdf_path.stem
+        with self.stats.stage("images"):
+            saved_images = self._save_images(ocr_result, stem)
+            renamed = self.image_optimizer.optimize(saved_images) if self.image_optimizer else {}
+        img_count = len(saved_images)
+        with self.stats.stage("markdown"):
+            md_path = self._save_markdown(ocr_result, stem, renamed)
 
-                dify_result = self.dify_processor.process_markdown(md_path, f"user_{stem}")
+        has_md = md_path and md_path.exists()
+        has_images = img_count > 0
 
-                if dify_result.get("success"):
-                    if dify_result.get("found_result_file"):
-                        note += " + Dify完成✅"
-                    else:
-                        note += " + Dify工作流成功但未生成文件⚠️"
-                else:
-                    dify_error = dify_result.get("error", "未知错误")
-                    note += f" + Dify失败❌: {dify_error}"
-                    self.logger.error(f"Dify处理失败: {dify_error}")
+        if has_md and has_images:
+            note = "OCR完成"
+        else:
+            missing = []
+            if not has_md: missing.append("MD")
+            if not has_images: missing.append("图片")
+            note = f"OCR部分缺失: {', '.join(missing)}"
 
-                self.tracker.update_record(pdf_name, note=note)
+        self.tracker.update_record(
+            pdf_name,
+            has_md=has_md,
+            has_images=has_images,
+            image_count=img_count,
+            note=note
+        )
+        if not has_md and retry_state is not None:
+            # Markdown写入失败不是临时错误，记为OCR阶段的永久失败
+            retry_state.failed_stage = "ocr"
+            retry_state.last_error = "OCR: 未能生成Markdown（详见日志）"
+            self.tracker.update_record(pdf_name, last_error=retry_state.last_error)
 
-            self.logger.info(f"✅ 完成处理: {pdf_name} (图片: {img_count})")
-            return has_md
+        if enable_dify and has_md and self.dify_processor:
+            self._run_dify(pdf_path, md_path, note, retry_state or RetryState(), retryable)
 
-        except Exception as e:
-            error_msg = str(e)
-            self.logger.error(f"❌ 处理失败 {pdf_name}: {error_msg}")
-            self.tracker.update_record(pdf_name, note=f"OCR错误: {error_msg}")
+        self.logger.info(f"✅ 完成处理: {pdf_name} (图片: {img_count})")
+        return has_md
+
+    def resume_dify(self, pdf_path: Path, retry_state: RetryState):
+        """OCR已完成、只有Dify阶段临时失败的文档，重试时直接使用已生成的Markdown。"""
+        md_path = Config.MD_OUT_DIR / f"{pdf_path.stem}.md"
+        if not md_path.exists():
+            self.logger.warning(f"Markdown不存在，重新OCR: {pdf_path.name}")
+            return self.process_pdf(pdf_path, True, retry_state)
+        if not self.dify_processor:
+            # 本次处理未启用Dify（或未配置API Key），无法完成重试，不能当作成功
+            retry_state.failed_stage = "dify"
+            retry_state.last_error = "Dify: 未启用Dify，无法重试"
+            self.logger.error(f"❌ Dify未启用，无法重试: {pdf_path.name}")
+            self.tracker.update_record(pdf_path.name, note="OCR完成 + Dify失败❌: 未启用Dify，无法重试",
+                                       last_error=retry_state.last_error)
             return False
+        try:
+            self._run_dify(pdf_path, md_path, "OCR完成", retry_state, True)
+        except ProcessingCancelled as e:
+            self.tracker.update_record(pdf_path.name, note=f"⏹️ {e}")
+            raise
+        return True
 
-    def _upload_and_ocr(self, pdf_path: Path) -> dict:
-        self.logger.info(f"上传PDF到Mistral: {pdf_path.name}")
+    def _run_dify(self, pdf_path: Path, md_path: Path, note: str, state: RetryState, retryable: bool):
+        pdf_name = pdf_path.name
+        attempt = state.begin("dify")
+        self.logger.info(f"开始Dify处理: {pdf_name}" + (f"（第{attempt}次尝试）" if attempt > 1 else ""))
+        self.tracker.update_record(pdf_name, note="开始Dify处理...", dify_attempts=attempt)
 
-        pdf_data = pdf_path.read_bytes()
-        file_payload: FileTypedDict = FileTypedDict(
-            file_name=pdf_path.stem,
-            content=pdf_data
-        )
+        dify_result = self.dify_processor.process_markdown(md_path, f"user_{pdf_path.stem}")
 
-        uploaded_file = self.client.files.upload(file=file_payload, purpose="ocr")
+        if dify_result.get("success"):
+            if dify_result.get("cached"):
+                note += " + Dify完成✅(缓存)"
+            elif dify_result.get("found_result_file"):
+                note += " + Dify完成✅"
+            else:
+                note += " + Dify工作流成功但未生成文件⚠️"
+        else:
+            dify_error = dify_result.get("error", "未知错误")
+            state.last_error = f"Dify: {dify_error}"
+            transient = dify_result.get("transient", False)
+            if retryable and transient and state.can_retry("dify"):
+                self.logger.warning(f"⏳ Dify临时错误，稍后重试 {pdf_name}（第{attempt}次）: {dify_error}")
+                self.tracker.update_record(pdf_name, note=f"{note} + ⏳Dify临时错误（将重试）: {dify_error}",
+                                           last_error=state.last_error)
+                raise RetryableFailure("dify", dify_error)
+            state.failed_stage = "dify"
+            note += f" + Dify失败❌: {dify_error}"
+            if transient and retryable:
+                note += f"（已重试{attempt}次）"
+            self.logger.error(f"Dify处理失败: {dify_error}")
+            self.tracker.update_record(pdf_name, last_error=state.last_error)
 
-        try:
-            signed_url = self.client.files.get_signed_url(file_id=uploaded_file.id, expiry=1).url
+        self.tracker.update_record(pdf_name, note=note)
 
-            self.logger.info(f"执行OCR处理: {pdf_path.name}")
-            ocr_response = self.client.ocr.process(
-                document=DocumentURLChunk(document_url=signed_url),
-                model=Config.MODEL_NAME,
-                include_image_base64=True
-            )
+    def _upload_and_ocr(self, pdf_path: Path) -> Tuple[dict, str]:
+        """执行OCR，返回 (OCR结果, 文件SHA256)。"""
+        file_size = pdf_path.stat().st_size
+        if file_size <= Config.INLINE_OCR_MAX_BYTES:
+            return self._inline_ocr(pdf_path)
+
+        self.logger.info(f"上传PDF到Mistral: {pdf_path.name}")
 
-            return json.loads(ocr_response.model_dump_json())
+        # 从文件句柄流式上传，内存占用与文件大小无关；哈希在同一遍读取中计算
+        with HashingReader(pdf_path) as reader:
+            file_payload: FileTypedDict = FileTypedDict(
+                file_name=pdf_path.stem,
+                content=reader
+            )
+            uploaded_file = self.cancel_token.run(
+                "上传", self.client.files.upload,
+                file=file_payload, purpose="ocr",
+                timeout=Config.OCR_UPLOAD_TIMEOUT,
+                timeout_ms=int(Config.OCR_UPLOAD_TIMEOUT * 1000),
+                on_late_result=lambda late_file: self._cleanup_upload(late_file.id)
+            )
+            file_hash = reader.hexdigest()
 
+        try:
+            signed_url = self.cancel_token.run(
+                "上传", self.client.files.get_signed_url,
+                file_id=uploaded_file.id, expiry=1,
+                timeout=Config.OCR_UPLOAD_TIMEOUT
+            ).url
+            return self._run_ocr(signed_url, pdf_path.name), file_hash
         finally:
-            try:
-                self.client.files.delete(file_id=uploaded_file.id)
-                self.logger.debug(f"清理上传文件: {uploaded_file.id}")
-            except Exception as e:
-                self.logger.warning(f"清理上传文件失败 {uploaded_file.id}: {e}")
+            self._cleanup_upload(uploaded_file.id)
+
+    def _inline_ocr(self, pdf_path: Path) -> Tuple[dict, str]:
+        self.logger.info(f"小文件内联OCR: {pdf_path.name}")
+        pdf_data = pdf_path.read_bytes()
+        file_hash = hashlib.sha256(pdf_data).hexdigest()
+        encoded = base64.b64encode(pdf_data).decode('ascii')
+        return self._run_ocr(f"data:application/pdf;base64,{encoded}", pdf_path.name), file_hash
+
+    def _run_ocr(self, document_url: str, pdf_name: str) -> dict:
+        self.logger.info(f"执行OCR处理: {pdf_name}")
+        ocr_response = self.cancel_token.run(
+            "OCR", self.client.ocr.process,
+            document=DocumentURLChunk(document_url=document_url),
+            model=Config.MODEL_NAME,
+            include_image_base64=True,
+            timeout=Config.OCR_TIMEOUT,
+            timeout_ms=int(Config.OCR_TIMEOUT * 1000)
+        )
+        return json.loads(ocr_response.model_dump_json())
+
+    def _cleanup_upload(self, file_id: str):
+        if self.file_reaper:
+            self.file_reaper.submit(file_id)
+            return
+        try:
+            self.client.files.delete(file_id=file_id)
+            self.logger.debug(f"清理上传文件: {file_id}")
+        except Exception as e:
+            self.logger.warning(f"清理上传文件失败 {file_id}: {e}")
 
-    def _save_images(self, ocr_result: dict, stem: str) -> int:
+    def _save_images(self, ocr_result: dict, stem: str) -> List[Path]:
         try:
             image_folder = Config.IMAGE_DIR / stem
             image_folder.mkdir(parents=True, exist_ok=True)
-            image_count = 0
+            saved_images = []
             self.logger.info(f"保存图片: {stem}")
             for page_idx, page in enumerate(ocr_result.get('pages', []), start=1):
                 for img_idx, img in enumerate(page.get('images', []), start=1):
@@ -125,15 +260,15 @@ class PDFProcessor:
                         img_path = image_folder / img_filename
                         img_path.write_bytes(image_data)
                         self.logger.debug(f"保存图片: {img_filename}")
-                        image_count += 1
+                        saved_images.append(img_path)
                     except Exception as e:
                         self.logger.error(f"处理图片失败: {e}")
 
-            self.logger.info(f"完成图片保存: {image_count} 张")
-            return image_count
+            self.logger.info(f"完成图片保存: {len(saved_images)} 张")
+            return saved_images
         except Exception as e:
             self.logger.error(f"保存图片过程失败: {e}")
-            return 0
+            return []
 
     def _detect_image_format(self, image_data: bytes) -> str:
         if image_data.startswith(b'\xff\xd8\xff'):
@@ -147,7 +282,8 @@ class PDFProcessor:
         else:
             return 'jpg'
 
-    def _save_markdown(self, ocr_result: dict, stem: str):
+    def _save_markdown(self, ocr_result: dict, stem: str, renamed: Optional[Dict[str, str]] = None):
+        renamed = renamed or {}
         try:
             self.logger.info(f"生成Markdown: {stem}")
             img_map = {}
@@ -163,6 +299,7 @@ class PDFProcessor:
                         except:
                             pass
                     actual_filename = f"{stem}_p{page_idx}_img{img_idx:02d}.{actual_format}"
+                    actual_filename = renamed.get(actual_filename, actual_filename)
                     actual_img_path = Config.IMAGE_DIR / stem / actual_filename
                     actual_rel_path = str(actual_img_path.relative_to(Config.MD_OUT_DIR.parent)).replace('\\', '/')
                     img_map[img_id] = actual_rel_path
@@ -189,7 +326,29 @@ class PDFProcessor:
             md_path = Config.MD_OUT_DIR / f"{stem}.md"
             md_path.write_text(full_markdown, encoding='utf-8')
             self.logger.info(f"✅ Markdown保存完成: {md_path}")
+            if self.search_index:
+                self.search_index.add(stem, md_path, md_pages)
             return md_path
         except Exception as e:
             self.logger.error(f"保存Markdown失败 {stem}: {e}")
             return None
+
+
+def build_processor(client: Mistral, tracker, cancel_token: CancelToken, enable_dify: bool = True,
+                    use_dify_cache: bool = None, recompress_images: bool = None,
+                    search_index=None, stats: ProcessingStats = None) -> PDFProcessor:
+    """
+    界面和--worker模式共用的处理器装配，处理同一共享队列的主机按相同的配置生成结果。
+    未指定的选项取自Config（DIFY_CACHE_ENABLED、IMAGE_RECOMPRESS）。
+    """
+    if use_dify_cache is None:
+        use_dify_cache = Config.DIFY_CACHE_ENABLED
+    if recompress_images is None:
+        recompress_images = Config.IMAGE_RECOMPRESS
+    stats = stats or ProcessingStats()
+    dify_processor = None
+    if enable_dify and Config.DIFY_API_KEY:
+        dify_processor = DifyProcessor(tracker, DifyResultCache(refresh=not use_dify_cache), cancel_token, stats)
+    image_optimizer = ImageOptimizer() if recompress_images and PIL_AVAILABLE else None
+    return PDFProcessor(client, tracker, dify_processor, image_optimizer, MistralFileReaper(client),
+                        cancel_token, search_index, stats)
@@ -0,0 +1,83 @@
+# retry.py
+import random
+from typing import Dict, Optional
+
+import requests
+
+from config import Config
+from cancellation import StageTimeout
+
+try:
+    import httpx
+except ImportError:  # mistralai依赖httpx，正常情况下总是可用
+    httpx = None
+
+# 可重试的阶段及显示名称，两个阶段的尝试次数分别计算
+RETRY_STAGES = {
+    "ocr": "OCR",
+    "dify": "Dify",
+}
+
+
+class RetryableFailure(Exception):
+    """某个阶段出现临时性错误，调用方应在退避后把文档重新放回队列。"""
+
+    def __init__(self, stage: str, error: str):
+        super().__init__(f"{RETRY_STAGES[stage]}临时错误: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class RetryState:
+    """单个文档在本批处理中的重试状态，随任务一起在队列中流转。"""
+
+    def __init__(self, stage: str = "ocr", attempts: Dict[str, int] = None, last_error: str = ""):
+        self.stage = stage
+        self.attempts = {name: 0 for name in RETRY_STAGES}
+        self.attempts.update(attempts or {})
+        self.last_error = last_error
+        self.failed_stage: Optional[str] = None
+
+    def begin(self, stage: str) -> int:
+        self.stage = stage
+        self.attempts[stage] += 1
+        return self.attempts[stage]
+
+    def can_retry(self, stage: str) -> bool:
+        return self.attempts[stage] < max_attempts(stage)
+
+    def next_delay(self) -> float:
+        return backoff_delay(self.attempts[self.stage])
+
+
+def max_attempts(stage: str) -> int:
+    return Config.RETRY_MAX_ATTEMPTS_DIFY if stage == "dify" else Config.RETRY_MAX_ATTEMPTS_OCR
+
+
+def backoff_delay(attempt: int) -> float:
+    """指数退避：第n次失败后等待 base * 2^(n-1) 秒，加入±20%抖动避免同时重试，加抖动后仍不超过上限。"""
+    delay = min(Config.RETRY_BASE_DELAY * (2 ** max(attempt - 1, 0)), Config.RETRY_MAX_DELAY)
+    return min(delay * random.uniform(0.8, 1.2), Config.RETRY_MAX_DELAY)
+
+
+def is_transient_status(status_code: Optional[int]) -> bool:
+    return status_code in (408, 425, 429) or (status_code is not None and status_code >= 500)
+
+
+def is_transient(error: BaseException) -> bool:
+    """网络中断、超时、限流和5xx视为临时错误；参数错误、认证失败、文件损坏等视为永久错误。"""
+    if isinstance(error, StageTimeout):
+        return True
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return is_transient_status(error.response.status_code)
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    # mistralai的SDKError等携带HTTP状态码
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return is_transient_status(status_code)
+    if type(error).__name__ == "NoResponseError":
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
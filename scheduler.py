@@ -0,0 +1,229 @@
+# scheduler.py
+import heapq
+import itertools
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from config import Config
+from retry import RetryState
+
+# 调度策略: 名称 -> 界面显示
+POLICIES = {
+    "fifo": "先进先出",
+    "sjf": "小文件优先（最短作业优先）",
+    "ljf": "大文件优先（缩短总耗时）",
+}
+
+# 页树节点（/Type /Pages）字典中的 /Count，两个键的先后顺序不固定
+_PAGES_COUNT = re.compile(
+    rb"/Type\s*/Pages(?![a-zA-Z])[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages(?![a-zA-Z])")
+# 对象流（PDF 1.5+），页树节点可能被压缩在其中
+_OBJECT_STREAM = re.compile(rb"<<(?:(?!>>).)*?/Type\s*/ObjStm(?:(?!>>).)*?>>\s*stream\r?\n", re.S)
+
+# 页树根节点通常在文件开头（线性化）或末尾（增量保存），只读取头尾各一段
+_SCAN_BYTES = 256 * 1024
+_INFLATE_LIMIT = 4 * 1024 * 1024
+_ESTIMATE_WORKERS = 8
+
+
+def _page_counts(data: bytes) -> List[int]:
+    counts = [int(m.group(1) or m.group(2)) for m in _PAGES_COUNT.finditer(data)]
+    for m in _OBJECT_STREAM.finditer(data):
+        try:
+            # 流可能在读取窗口处被截断，解压出多少算多少
+            inflated = zlib.decompressobj().decompress(data[m.end():], _INFLATE_LIMIT)
+        except zlib.error:
+            continue
+        counts.extend(int(c.group(1) or c.group(2)) for c in _PAGES_COUNT.finditer(inflated))
+    return counts
+
+
+def estimate_pages(pdf_path: Path) -> int:
+    """
+    从页树读取PDF页数：根节点的 /Count 即总页数，各节点中最大的 /Count 就是根节点的。
+    只读取文件头尾各 _SCAN_BYTES 字节，找不到页树（或文件损坏）时返回0，成本只按文件大小估算。
+    """
+    try:
+        with open(pdf_path, "rb") as f:
+            head = f.read(_SCAN_BYTES)
+            size = f.seek(0, 2)
+            tail = b""
+            if size > len(head):
+                f.seek(max(size - _SCAN_BYTES, len(head)))
+                tail = f.read()
+    except OSError:
+        return 0
+    return max(_page_counts(head) + _page_counts(tail), default=0)
+
+
+def estimate_cost(pdf_path: Path) -> float:
+    """以页数为主、文件大小为辅估算处理成本，单位约等于“页”。"""
+    try:
+        size_mb = pdf_path.stat().st_size / (1024 * 1024)
+    except OSError:
+        size_mb = 0.0
+    pages = estimate_pages(pdf_path)
+    return pages + size_mb * Config.SCHEDULER_MB_WEIGHT
+
+
+def estimate_costs(paths: Sequence[Path]) -> List[float]:
+    """并行估算多个文件的成本（以读文件为主，线程并行即可）。"""
+    if len(paths) <= 1:
+        return [estimate_cost(Path(p)) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(_ESTIMATE_WORKERS, len(paths)),
+                            thread_name_prefix="estimate") as pool:
+        return list(pool.map(lambda p: estimate_cost(Path(p)), paths))
+
+
+class Job:
+    def __init__(self, path: Path, cost: Optional[float], seq: int):
+        self.path = path
+        self._cost = cost
+        self.seq = seq
+        self.high_priority = False
+        self.retry_state = RetryState()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def cost(self) -> float:
+        # 先进先出策略排序时不需要成本，在处理时（工作线程中）再估算
+        if self._cost is None:
+            self._cost = estimate_cost(self.path)
+        return self._cost
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+    @property
+    def latency(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.enqueued_at
+
+
+class JobScheduler:
+    """
+    位于工作线程池前面的任务队列，按调度策略和优先级决定下一个处理的文件。
+    临时失败的任务通过 retry() 延迟重新入队；仍有任务在处理或等待重试时 get() 会等待而不是返回None。
+    """
+
+    def __init__(self, policy: str = None):
+        self.policy = policy or Config.SCHEDULER_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"未知的调度策略: {self.policy}")
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self._heap = []
+        self._delayed = []
+        self._active = 0
+        self._entries: Dict[Path, list] = {}
+        self._counter = itertools.count()
+        self._closed = False
+        self.jobs: List[Job] = []
+
+    def _sort_key(self, job: Job):
+        if self.policy == "sjf":
+            order = job.cost
+        elif self.policy == "ljf":
+            order = -job.cost
+        else:
+            order = 0
+        return (0 if job.high_priority else 1, order, job.seq)
+
+    def _push(self, job: Job):
+        entry = [self._sort_key(job), job, True]
+        self._entries[job.path] = entry
+        heapq.heappush(self._heap, entry)
+
+    def add(self, paths: Iterable[Path], high_priority: Iterable[Path] = ()):
+        high_priority = set(high_priority)
+        paths = list(paths)
+        costs = estimate_costs(paths) if self.policy != "fifo" else [None] * len(paths)
+        with self.lock:
+            for path, cost in zip(paths, costs):
+                job = Job(path, cost, next(self._counter))
+                job.high_priority = path in high_priority
+                self.jobs.append(job)
+                self._push(job)
+            self.changed.notify_all()
+
+    def bump(self, path: Path) -> bool:
+        """把仍在排队的文件提升为高优先级，返回是否成功。"""
+        with self.lock:
+            entry = self._entries.get(path)
+            if not entry or not entry[2]:
+                return False
+            entry[2] = False
+            job = entry[1]
+            job.high_priority = True
+            self._push(job)
+            return True
+
+    def get(self) -> Optional[Job]:
+        """取出下一个任务；所有任务都已完成或队列已关闭时返回None。"""
+        with self.lock:
+            while not self._closed:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, job = heapq.heappop(self._delayed)
+                    self._push(job)
+                while self._heap:
+                    _, job, valid = heapq.heappop(self._heap)
+                    if not valid:
+                        continue
+                    del self._entries[job.path]
+                    if job.started_at is None:
+                        job.started_at = now
+                    self._active += 1
+                    return job
+                if not self._delayed and not self._active:
+                    return None
+                # 等待重试时间到达，或其他线程的任务完成/重新入队
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self.changed.wait(timeout)
+            return None
+
+    def task_done(self, job: Job):
+        job.finished_at = time.monotonic()
+        with self.lock:
+            self._active -= 1
+            self.changed.notify_all()
+
+    def retry(self, job: Job, delay: float):
+        """临时失败的任务在 delay 秒后重新入队，保持原有优先级。"""
+        with self.lock:
+            self._active -= 1
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._counter), job))
+            self.changed.notify_all()
+
+    def waiting_retries(self) -> int:
+        with self.lock:
+            return len(self._delayed)
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            self.changed.notify_all()
+
+    def summary(self) -> str:
+        """已完成文件的排队等待和完成耗时统计。"""
+        with self.lock:
+            finished = [job for job in self.jobs if job.finished_at]
+        if not finished:
+            return "无已完成文件"
+        waits = sorted(job.queue_wait for job in finished)
+        latencies = sorted(job.latency for job in finished)
+
+        def pct(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return (f"策略 {POLICIES[self.policy]}: "
+                f"排队等待 平均 {sum(waits) / len(waits):.1f}s / p50 {pct(waits, 0.5):.1f}s / p95 {pct(waits, 0.95):.1f}s, "
+                f"完成耗时 平均 {sum(latencies) / len(latencies):.1f}s / p50 {pct(latencies, 0.5):.1f}s / "
+                f"p95 {pct(latencies, 0.95):.1f}s")
@@ -0,0 +1,236 @@
+# search_index.py
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from config import Config
+
+# 每页的FTS rowid = 文档id * PAGE_STRIDE + 页码，删除某个文档时按rowid区间删除，无需全表扫描
+PAGE_STRIDE = 100000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc TEXT UNIQUE NOT NULL,
+    md_path TEXT,
+    page_count INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    indexed_at TEXT
+);
+"""
+
+# trigram分词支持中文子串检索（SQLite 3.34+），旧版本退回unicode61
+_TOKENIZERS = ("trigram", "unicode61")
+
+# 少于3个字符的词（大部分中文词语，如"合同"）无法用trigram匹配，另建一张按相邻两字切分的索引表。
+# 只保存索引不保存原文（contentless），原文从pages表读取
+_GRAMS_SCHEMA = "CREATE VIRTUAL TABLE page_grams USING fts5(grams, content='', tokenize='unicode61')"
+_SHORT_TERM = 3
+
+# snippet最多包含的词元数，trigram下一个字符约为一个词元
+_SNIPPET_TOKENS = 64
+
+
+def _bigrams(content: str) -> str:
+    """每个字符与其后一个字符组成一个词元（最后一个字符单独成词元），一个字的词按前缀匹配。"""
+    return " ".join(content[i:i + 2] for i in range(len(content)))
+
+
+def _grams_query(terms: Sequence[str]) -> str:
+    return " AND ".join('"' + t.replace('"', '""') + '"' + ("*" if len(t) == 1 else "") for t in terms)
+
+
+def _make_snippet(content: str, term: str, width: int = 24) -> str:
+    pos = content.lower().find(term.lower())
+    if pos < 0:
+        return content[:width * 2] + ("…" if len(content) > width * 2 else "")
+    start, end = max(pos - width, 0), pos + len(term) + width
+    return ("…" if start else "") + content[start:pos] + f"【{content[pos:pos + len(term)]}】" + \
+        content[pos + len(term):end] + ("…" if end < len(content) else "")
+
+
+class MarkdownSearchIndex:
+    """
+    生成的Markdown的全文索引（SQLite FTS5），按文档+页码建立。
+    add() 只放入缓冲区，累积到 batch_size 个文档或调用 flush() 时在一个事务中写入。
+    同一文档重新索引时先删除旧页再写入，内容未变化则直接跳过。
+    """
+
+    def __init__(self, db_path: Path = None, batch_size: int = None):
+        self.db_path = Path(db_path or Config.SEARCH_INDEX_DB)
+        self.batch_size = batch_size or Config.SEARCH_INDEX_BATCH
+        self.logger = logging.getLogger(f"{__name__}.MarkdownSearchIndex")
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending: Dict[str, tuple] = {}
+        self.tokenizer = None
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            # 索引库只由本机写入，使用WAL让搜索与批量写入互不阻塞
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self.tokenizer = self._create_fts_table(conn)
+        self.available = self.tokenizer is not None
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.create_function("bigrams", 1, _bigrams, deterministic=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _create_fts_table(self, conn) -> Optional[str]:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'pages'").fetchone()
+        if row:
+            tokenizer = next((t for t in _TOKENIZERS if t in row[0]), _TOKENIZERS[-1])
+        else:
+            tokenizer = None
+            for candidate in _TOKENIZERS:
+                try:
+                    conn.execute(f"CREATE VIRTUAL TABLE pages USING fts5(content, tokenize='{candidate}')")
+                    tokenizer = candidate
+                    break
+                except sqlite3.OperationalError as e:
+                    self.logger.warning(f"FTS5分词器 {candidate} 不可用: {e}")
+            if tokenizer is None:
+                self.logger.error("❌ 当前SQLite不支持FTS5，全文索引已禁用")
+                return None
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'page_grams'").fetchone():
+            # 旧索引库没有短词索引表，按已有页面补建
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(_GRAMS_SCHEMA)
+            conn.execute("INSERT INTO page_grams (rowid, grams) SELECT rowid, bigrams(content) FROM pages")
+            conn.execute("COMMIT")
+        return tokenizer
+
+    @staticmethod
+    def _delete_pages(conn, doc_id: int):
+        low, high = doc_id * PAGE_STRIDE, doc_id * PAGE_STRIDE + PAGE_STRIDE - 1
+        # contentless表删除时需要提供原来写入的内容
+        conn.execute("INSERT INTO page_grams (page_grams, rowid, grams) "
+                     "SELECT 'delete', rowid, bigrams(content) FROM pages WHERE rowid BETWEEN ? AND ?",
+                     (low, high))
+        conn.execute("DELETE FROM pages WHERE rowid BETWEEN ? AND ?", (low, high))
+
+    def add(self, doc: str, md_path: Path, pages: Sequence[str]):
+        """加入待写入缓冲区，同一文档只保留最新的一次。"""
+        if not self.available:
+            return
+        with self.lock:
+            self.pending[doc] = (str(md_path), list(pages))
+            should_flush = len(self.pending) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> int:
+        """在一个事务中写入缓冲区内的所有文档，返回实际更新的文档数。"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        updated = 0
+        try:
+            with self.write_lock, self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for doc, (md_path, pages) in pending.items():
+                        updated += self._write_document(conn, doc, md_path, pages)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            self.logger.error(f"❌ 写入全文索引失败（{len(pending)}个文档）: {e}")
+            return 0
+        self.logger.info(f"🔎 全文索引已更新: {updated}/{len(pending)} 个文档")
+        return updated
+
+    def _write_document(self, conn, doc: str, md_path: str, pages: List[str]) -> int:
+        digest = hashlib.sha256()
+        for page in pages:
+            digest.update(page.encode("utf-8"))
+            digest.update(b"\0")
+        content_hash = digest.hexdigest()
+
+        row = conn.execute("SELECT id, content_hash, md_path FROM documents WHERE doc = ?", (doc,)).fetchone()
+        if row and row[1] == content_hash and row[2] == md_path:
+            return 0
+        indexed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if row:
+            doc_id = row[0]
+            self._delete_pages(conn, doc_id)
+            conn.execute("UPDATE documents SET md_path = ?, page_count = ?, content_hash = ?, indexed_at = ? "
+                         "WHERE id = ?", (md_path, len(pages), content_hash, indexed_at, doc_id))
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO documents (doc, md_path, page_count, content_hash, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (doc, md_path, len(pages), content_hash, indexed_at)
+            ).lastrowid
+        rows = [(doc_id * PAGE_STRIDE + page_no, content)
+                for page_no, content in enumerate(pages[:PAGE_STRIDE - 1], start=1) if content.strip()]
+        conn.executemany("INSERT INTO pages (rowid, content) VALUES (?, ?)", rows)
+        conn.executemany("INSERT INTO page_grams (rowid, grams) VALUES (?, bigrams(?))", rows)
+        return 1
+
+    def remove(self, doc: str) -> bool:
+        with self.lock:
+            self.pending.pop(doc, None)
+        with self.write_lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id FROM documents WHERE doc = ?", (doc,)).fetchone()
+            if row:
+                self._delete_pages(conn, row[0])
+                conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        return row is not None
+
+    def search(self, query: str, limit: int = 100) -> List[dict]:
+        """
+        全文搜索，多个关键词以空格分隔（同时包含）。
+        返回按相关度排序的 [{doc, page, md_path, snippet}]。
+        """
+        terms = query.split()
+        if not self.available or not terms:
+            return []
+        long_terms = [t for t in terms if len(t) >= _SHORT_TERM]
+        short_terms = [t for t in terms if len(t) < _SHORT_TERM]
+        if long_terms:
+            where = "pages MATCH ?"
+            params = [" AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)]
+            if short_terms:
+                where += " AND p.rowid IN (SELECT rowid FROM page_grams WHERE page_grams MATCH ?)"
+                params.append(_grams_query(short_terms))
+            sql = (f"SELECT d.doc, p.rowid % {PAGE_STRIDE}, d.md_path, "
+                   f"snippet(pages, 0, '【', '】', '…', {_SNIPPET_TOKENS}) "
+                   f"FROM pages p JOIN documents d ON d.id = p.rowid / {PAGE_STRIDE} "
+                   f"WHERE {where} ORDER BY bm25(pages) LIMIT ?")
+        else:
+            # 只有短词：在两字索引表中检索，摘要由原文生成
+            params = [_grams_query(short_terms)]
+            sql = (f"SELECT d.doc, p.rowid % {PAGE_STRIDE}, d.md_path, p.content "
+                   f"FROM page_grams g JOIN pages p ON p.rowid = g.rowid "
+                   f"JOIN documents d ON d.id = p.rowid / {PAGE_STRIDE} "
+                   f"WHERE page_grams MATCH ? ORDER BY bm25(page_grams) LIMIT ?")
+        params.append(limit)
+
+        started = time.perf_counter()
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        self.logger.debug(f"🔎 搜索 {query!r}: {len(rows)} 条, {(time.perf_counter() - started) * 1000:.1f}ms")
+        if not long_terms:
+            rows = [(doc, page, md_path, _make_snippet(content, terms[0])) for doc, page, md_path, content in rows]
+        return [{"doc": doc, "page": page, "md_path": md_path, "snippet": snippet.replace("\n", " ")}
+                for doc, page, md_path, snippet in rows]
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            docs, pages = conn.execute("SELECT COUNT(*), COALESCE(SUM(page_count), 0) FROM documents").fetchone()
+        return {"documents": docs, "pages": pages}
@@ -0,0 +1,122 @@
+# stats.py
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import Config
+
+# 统计的处理阶段及界面显示名称
+STAGES = {
+    "ocr": "OCR",
+    "images": "图片",
+    "markdown": "Markdown",
+    "dify_queue": "Dify排队",
+    "dify_upload": "Dify上传",
+    "workflow": "工作流",
+    "result_wait": "等待结果",
+}
+
+
+def _percentile(sorted_values, q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ProcessingStats:
+    """
+    处理过程的实时统计：各阶段进行中的数量、最近耗时的p50/p95、滚动吞吐量和预计剩余时间。
+    工作线程每进出一个阶段只做一次加锁计数，计算全部在界面线程调用 snapshot() 时进行。
+    """
+
+    def __init__(self, total: int = 0, window_seconds: float = None, samples: int = None):
+        self.window_seconds = window_seconds or Config.STATS_WINDOW_SECONDS
+        samples = samples or Config.STATS_SAMPLES
+        self.lock = threading.Lock()
+        self.total = total
+        self.done = 0
+        self.started_at = time.monotonic()
+        self.in_flight: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.finished: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.latencies: Dict[str, deque] = {stage: deque(maxlen=samples) for stage in STAGES}
+        self.completions = deque()
+
+    def set_total(self, total: int):
+        with self.lock:
+            self.total = total
+
+    @contextmanager
+    def stage(self, name: str):
+        with self.lock:
+            self.in_flight[name] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.in_flight[name] -= 1
+                self.finished[name] += 1
+                self.latencies[name].append(elapsed)
+
+    def document_done(self):
+        now = time.monotonic()
+        with self.lock:
+            self.done += 1
+            self.completions.append(now)
+
+    def sync_done(self, done: int, total: int):
+        """用外部计数（如共享队列中所有主机的完成数）同步进度，新增的完成数计入吞吐量。"""
+        now = time.monotonic()
+        with self.lock:
+            self.completions.extend([now] * max(done - self.done, 0))
+            self.done = done
+            self.total = total
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            while self.completions and self.completions[0] < now - self.window_seconds:
+                self.completions.popleft()
+            recent = len(self.completions)
+            done, total = self.done, self.total
+            in_flight = dict(self.in_flight)
+            finished = dict(self.finished)
+            latencies = {stage: sorted(values) for stage, values in self.latencies.items()}
+
+        elapsed = now - self.started_at
+        # 按最近窗口内的完成数计算吞吐量（滑动平均），刚开始时窗口按已运行时间计
+        span = min(self.window_seconds, elapsed)
+        per_minute = recent / span * 60 if span > 0 else 0.0
+        remaining = max(total - done, 0)
+        eta = remaining / per_minute * 60 if per_minute > 0 else None
+        return {
+            "done": done,
+            "total": total,
+            "elapsed": elapsed,
+            "per_minute": per_minute,
+            "eta": eta,
+            "stages": {
+                stage: {
+                    "in_flight": in_flight[stage],
+                    "finished": finished[stage],
+                    "p50": _percentile(latencies[stage], 0.5),
+                    "p95": _percentile(latencies[stage], 0.95),
+                }
+                for stage in STAGES
+            },
+        }
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
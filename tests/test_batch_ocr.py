@@ -0,0 +1,134 @@
+import itertools
+from pathlib import Path
+
+import pytest
+
+from batch_ocr import BatchJobClient, BatchOCRRunner
+
+
+class FakeBatchClient(BatchJobClient):
+    """本地假实现：任务提交后立即完成，每个文档返回一页Markdown。"""
+
+    def __init__(self, fail_submits: int = 0, fail_uploads=()):
+        self.fail_submits = fail_submits
+        self.fail_uploads = set(fail_uploads)
+        self.uploaded = []
+        self.deleted = []
+        self.jobs = {}
+        self._ids = itertools.count()
+
+    def prepare_document(self, pdf_path: Path):
+        if pdf_path.name in self.fail_uploads:
+            raise ConnectionError("upload failed")
+        file_id = f"file-{next(self._ids)}"
+        self.uploaded.append(pdf_path)
+        return {"document_url": f"https://fake/{file_id}", "file_id": file_id, "file_hash": "0" * 64}
+
+    def submit(self, requests):
+        if self.fail_submits:
+            self.fail_submits -= 1
+            raise ConnectionError("batch endpoint unavailable")
+        job_id = f"job-{next(self._ids)}"
+        self.jobs[job_id] = [r["custom_id"] for r in requests]
+        return job_id
+
+    def get_status(self, job_id):
+        return "SUCCESS"
+
+    def fetch_results(self, job_id):
+        for custom_id in self.jobs[job_id]:
+            yield custom_id, {"pages": [{"markdown": custom_id, "images": []}]}, None
+
+    def delete_file(self, file_id):
+        self.deleted.append(file_id)
+
+
+class FakeTracker:
+    def update_record(self, pdf_name, **kwargs):
+        pass
+
+
+class FakeProcessor:
+    """dify_failures 中的文档模拟OCR成功但Dify失败。"""
+
+    def __init__(self, dify_failures=()):
+        self.tracker = FakeTracker()
+        self.processed = []
+        self.dify_failures = set(dify_failures)
+
+    def process_ocr_result(self, pdf_path, ocr_result, enable_dify=False, retry_state=None, retryable=None):
+        self.processed.append(pdf_path)
+        if pdf_path.name in self.dify_failures:
+            retry_state.failed_stage = "dify"
+            retry_state.last_error = "Dify: 工作流失败"
+        return True
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    return [tmp_path / f"doc{i}.pdf" for i in range(5)]
+
+
+def make_runner(tmp_path, client, processor=None, chunk_size=2):
+    return BatchOCRRunner(processor or FakeProcessor(), client, tmp_path / "state.json",
+                          poll_interval=0, chunk_size=chunk_size)
+
+
+def test_client_interface_is_abstract():
+    with pytest.raises(TypeError):
+        BatchJobClient()
+
+
+def test_run_processes_all_documents_in_chunks(tmp_path, pdfs):
+    client = FakeBatchClient()
+    processor = FakeProcessor()
+    done = []
+    success, total = make_runner(tmp_path, client, processor).run(
+        pdfs, on_document_done=lambda path, ok, state: done.append((path, ok)))
+    assert (success, total) == (5, 5)
+    assert len(client.jobs) == 3
+    assert sorted(processor.processed) == sorted(pdfs)
+    assert len(client.deleted) == 5
+    assert make_runner(tmp_path, client).pending_documents() == []
+
+
+def test_failed_submit_keeps_uploads_for_next_run(tmp_path, pdfs):
+    client = FakeBatchClient(fail_submits=10)
+    runner = make_runner(tmp_path, client)
+    assert runner.submit(pdfs) == []
+    assert sorted(runner.pending_documents()) == sorted(pdfs)
+
+    # 程序重启后直接提交已上传的文档，不重新上传
+    client.fail_submits = 0
+    processor = FakeProcessor()
+    success, total = make_runner(tmp_path, client, processor).run([])
+    assert (success, total) == (5, 5)
+    assert len(client.uploaded) == 5
+    assert sorted(processor.processed) == sorted(pdfs)
+
+
+def test_interrupted_upload_resumes_without_reuploading(tmp_path, pdfs):
+    client = FakeBatchClient()
+    stop_after = iter([False, False, False, True])
+    runner = make_runner(tmp_path, client, chunk_size=10)
+    assert runner.submit(pdfs, should_stop=lambda: next(stop_after, True)) == []
+    assert len(runner.pending_documents()) == 3
+
+    processor = FakeProcessor()
+    success, total = make_runner(tmp_path, client, processor, chunk_size=10).run(pdfs)
+    assert (success, total) == (5, 5)
+    assert len(client.uploaded) == 5
+    assert len(client.jobs) == 1
+
+
+def test_upload_and_dify_failures_are_reported(tmp_path, pdfs):
+    client = FakeBatchClient(fail_uploads={"doc1.pdf"})
+    processor = FakeProcessor(dify_failures={"doc3.pdf"})
+    upload_failed, failed_stages = [], {}
+    success, total = make_runner(tmp_path, client, processor).run(
+        pdfs, enable_dify=True,
+        on_document_done=lambda path, ok, state: failed_stages.update({path.name: state.failed_stage}),
+        on_upload_failed=lambda path, state: upload_failed.append((path.name, state.failed_stage)))
+    assert (success, total) == (4, 4)
+    assert upload_failed == [("doc1.pdf", "ocr")]
+    assert failed_stages == {"doc0.pdf": None, "doc2.pdf": None, "doc3.pdf": "dify", "doc4.pdf": None}
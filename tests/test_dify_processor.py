@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from config import Config
+from dify_processor import DifyProcessor
+
+
+class FakeTracker:
+    def update_record(self, pdf_name, **kwargs):
+        pass
+
+
+@pytest.fixture
+def result_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DIFY_RESULT_DIR", tmp_path)
+    return tmp_path
+
+
+def _write(path, text, mtime):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_result_written_with_skewed_clock_is_accepted(result_dir):
+    # 容器时钟比本机慢很多：新文件的mtime早于工作流开始时间，仍应识别为本次结果
+    _write(result_dir / "user_a_response.txt", "旧结果", 1_000_000)
+    existing = DifyProcessor._snapshot_results("user_a")
+    new_file = _write(result_dir / "user_a_response_2.txt", "新结果", 900_000)
+    _write(result_dir / "user_ab_response.txt", "其他文档", 2_000_000_000)
+
+    processor = DifyProcessor(FakeTracker())
+    assert processor._check_result_file("a.pdf", "user_a", existing, max_wait=1) == new_file
+
+
+def test_rewritten_result_is_accepted_and_unchanged_one_is_not(result_dir):
+    result = _write(result_dir / "user_a_response.txt", "旧结果", 1_000_000)
+    existing = DifyProcessor._snapshot_results("user_a")
+    assert not DifyProcessor._is_own_result(result, "user_a", existing)
+    _write(result, "新的结果内容", 1_000_000)
+    assert DifyProcessor._is_own_result(result, "user_a", existing)
+    assert not DifyProcessor._is_own_result(result, "user_b", existing)
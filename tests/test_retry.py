@@ -0,0 +1,55 @@
+import pytest
+import requests
+
+from cancellation import StageTimeout
+from config import Config
+from retry import RetryState, backoff_delay, is_transient
+
+
+def _http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code}", response=response)
+
+
+class SDKError(Exception):
+    """与mistralai的SDKError一样带有status_code属性。"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"API error {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("error", [
+    _http_error(429), _http_error(500), _http_error(503), SDKError(429), SDKError(502),
+    requests.ConnectionError("reset"), requests.Timeout("read timeout"),
+    ConnectionResetError(), TimeoutError(), StageTimeout("OCR", 600),
+])
+def test_transient_errors(error):
+    assert is_transient(error)
+
+
+@pytest.mark.parametrize("error", [
+    _http_error(400), _http_error(401), _http_error(404), SDKError(400), SDKError(401),
+    ValueError("bad pdf"), KeyError("pages"),
+])
+def test_permanent_errors(error):
+    assert not is_transient(error)
+
+
+def test_backoff_grows_exponentially_and_is_capped(monkeypatch):
+    monkeypatch.setattr(Config, "RETRY_BASE_DELAY", 10)
+    monkeypatch.setattr(Config, "RETRY_MAX_DELAY", 60)
+    for attempt, base in [(1, 10), (2, 20), (3, 40)]:
+        assert base * 0.8 <= backoff_delay(attempt) <= base * 1.2
+    assert all(backoff_delay(attempt) <= 60 for attempt in range(4, 40) for _ in range(5))
+    assert all(backoff_delay(30) >= 60 * 0.8 for _ in range(20))
+
+
+def test_attempts_are_counted_per_stage(monkeypatch):
+    monkeypatch.setattr(Config, "RETRY_MAX_ATTEMPTS_OCR", 2)
+    monkeypatch.setattr(Config, "RETRY_MAX_ATTEMPTS_DIFY", 1)
+    state = RetryState()
+    assert state.begin("ocr") == 1 and state.can_retry("ocr")
+    assert state.begin("ocr") == 2 and not state.can_retry("ocr")
+    assert state.begin("dify") == 1 and not state.can_retry("dify")
@@ -0,0 +1,101 @@
+import threading
+import time
+import zlib
+
+from config import Config
+from scheduler import JobScheduler, estimate_pages
+
+
+def _pages_tree(count: int) -> bytes:
+    kids = " ".join(f"{3 + i} 0 R" for i in range(count))
+    return f"<< /Kids [{kids}] /Count {count} /Type /Pages >>".encode()
+
+
+def _write_pdf(path, body: bytes, padding: int = 0):
+    path.write_bytes(b"%PDF-1.7\n" + b"%" * padding + b"\n" + body + b"\ntrailer << /Root 1 0 R >>\n%%EOF\n")
+    return path
+
+
+def test_reads_count_from_page_tree_root(tmp_path):
+    body = (b"1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+            b"2 0 obj " + _pages_tree(12) + b" endobj\n"
+            b"9 0 obj << /Type /Pages /Parent 2 0 R /Count 4 >> endobj\n"
+            b"3 0 obj << /Type /Page /Parent 2 0 R >> endobj\n")
+    assert estimate_pages(_write_pdf(tmp_path / "plain.pdf", body)) == 12
+
+
+def test_reads_count_from_compressed_object_stream(tmp_path):
+    objects = b"2 0 " + _pages_tree(7)
+    data = zlib.compress(objects)
+    body = (f"5 0 obj << /Type /ObjStm /N 1 /First 4 /Filter /FlateDecode /Length {len(data)} >>\nstream\n"
+            .encode() + data + b"\nendstream endobj\n")
+    # 对象流位于文件末尾，文件开头有大量无关数据
+    assert estimate_pages(_write_pdf(tmp_path / "objstm.pdf", body, padding=2 * 1024 * 1024)) == 7
+
+
+def test_missing_page_tree_returns_zero(tmp_path):
+    assert estimate_pages(_write_pdf(tmp_path / "broken.pdf", b"garbage")) == 0
+    assert estimate_pages(tmp_path / "missing.pdf") == 0
+
+
+def test_sjf_orders_by_estimated_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SCHEDULER_MB_WEIGHT", 0)
+    paths = [_write_pdf(tmp_path / f"doc{n}.pdf", b"1 0 obj " + _pages_tree(n) + b" endobj") for n in (9, 2, 5)]
+    scheduler = JobScheduler("sjf")
+    scheduler.add(paths)
+    assert [scheduler.get().path.name for _ in paths] == ["doc2.pdf", "doc5.pdf", "doc9.pdf"]
+
+
+def _fifo(tmp_path, count):
+    paths = [tmp_path / f"doc{i}.pdf" for i in range(count)]
+    scheduler = JobScheduler("fifo")
+    scheduler.add(paths)
+    return scheduler, paths
+
+
+def test_get_returns_none_once_all_tasks_are_done(tmp_path):
+    scheduler, paths = _fifo(tmp_path, 2)
+    jobs = [scheduler.get(), scheduler.get()]
+    assert [job.path for job in jobs] == paths
+    for job in jobs:
+        scheduler.task_done(job)
+    assert scheduler.get() is None
+
+
+def test_get_waits_for_active_task_before_returning_none(tmp_path):
+    scheduler, _ = _fifo(tmp_path, 1)
+    job = scheduler.get()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(scheduler.get()))
+    waiter.start()
+    time.sleep(0.1)
+    # 仍有任务在处理中（可能失败后重新入队），其他工作线程应等待而不是退出
+    assert waiter.is_alive()
+    scheduler.task_done(job)
+    waiter.join(2)
+    assert result == [None]
+
+
+def test_retried_job_is_handed_out_again_after_delay(tmp_path):
+    scheduler, paths = _fifo(tmp_path, 1)
+    job = scheduler.get()
+    started = time.monotonic()
+    scheduler.retry(job, 0.2)
+    assert scheduler.waiting_retries() == 1
+    again = scheduler.get()
+    assert again is job
+    assert time.monotonic() - started >= 0.2
+    scheduler.task_done(again)
+    assert scheduler.get() is None
+
+
+def test_close_wakes_waiting_workers(tmp_path):
+    scheduler, _ = _fifo(tmp_path, 1)
+    job = scheduler.get()
+    scheduler.retry(job, 60)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(scheduler.get()))
+    waiter.start()
+    scheduler.close()
+    waiter.join(2)
+    assert result == [None]
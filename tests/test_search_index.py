@@ -0,0 +1,44 @@
+import pytest
+
+from search_index import MarkdownSearchIndex
+
+PAGES = [
+    "本合同编号为HT-2024-001，由甲方与乙方于2024年签订，双方应按约定履行各自的义务，" * 2,
+    "附件：付款计划表，首付款于签约后十个工作日内支付。",
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MarkdownSearchIndex(tmp_path / "index.db", batch_size=10)
+    index.add("a.pdf", tmp_path / "a.md", PAGES)
+    index.add("b.pdf", tmp_path / "b.md", ["与本项目无关的其他内容。"])
+    index.flush()
+    return index
+
+
+def test_snippet_contains_whole_hit(index):
+    hit, = index.search("HT-2024-001")
+    assert (hit["doc"], hit["page"]) == ("a.pdf", 1)
+    assert "【HT-2024-001】，由甲方与乙方" in hit["snippet"]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("合同", [("a.pdf", 1)]),
+    ("付款 签约后", [("a.pdf", 2)]),
+    ("甲", [("a.pdf", 1)]),
+    ("项目", [("b.pdf", 1)]),
+    ("ht 合同", [("a.pdf", 1)]),
+    ("合约", []),
+])
+def test_short_terms_use_index(index, query, expected):
+    assert [(hit["doc"], hit["page"]) for hit in index.search(query)] == expected
+
+
+def test_reindex_and_remove_update_short_term_index(index, tmp_path):
+    index.add("a.pdf", tmp_path / "a.md", ["修订后的协议文本"])
+    index.flush()
+    assert index.search("合同") == []
+    assert [hit["doc"] for hit in index.search("协议")] == ["a.pdf"]
+    assert index.remove("a.pdf")
+    assert index.search("协议") == []
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, JobAborted
+from work_queue import SharedWorkQueue, run_worker
+
+
+class FakeProcessor:
+    """每个文档处理 delay 秒（可被取消），完成时把路径追加到记录文件；crash_on 指定的文档处理中途直接退出进程。"""
+
+    def __init__(self, record_path, delay=0.05, crash_on=None):
+        self.cancel_token = CancelToken()
+        self.record_path = record_path
+        self.delay = delay
+        self.crash_on = crash_on
+
+    def process_pdf(self, pdf_path, enable_dify=False, retry_state=None):
+        retry_state.begin("ocr")
+        if pdf_path.name == self.crash_on:
+            os._exit(1)
+        self.cancel_token.wait(self.delay, "OCR")
+        with open(self.record_path, "a", encoding="utf-8") as f:
+            f.write(f"{pdf_path}\n")
+        return True
+
+
+def _worker_process(db_path, record_path, lease_seconds, crash_on=None, threads=2):
+    queue = SharedWorkQueue(db_path, host=f"host{os.getpid()}", lease_seconds=lease_seconds, policy="fifo")
+    processor = FakeProcessor(record_path, crash_on=crash_on)
+    workers = [threading.Thread(target=run_worker, args=(queue, processor, lambda: False))
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _run_processes(ctx, args_list):
+    processes = [ctx.Process(target=_worker_process, args=args) for args in args_list]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    return processes
+
+
+def test_each_document_done_once_across_processes(tmp_path):
+    db_path, record_path = tmp_path / "queue.db", tmp_path / "done.txt"
+    paths = [tmp_path / f"doc{i:02d}.pdf" for i in range(30)]
+    queue = SharedWorkQueue(db_path, policy="fifo")
+    assert queue.enqueue(paths) == 30
+
+    ctx = multiprocessing.get_context("spawn")
+    _run_processes(ctx, [(db_path, record_path, 5.0) for _ in range(4)])
+
+    done = record_path.read_text(encoding="utf-8").split()
+    assert sorted(done) == sorted(str(p) for p in paths)
+    assert queue.counts() == {"done": 30}
+    with sqlite3.connect(str(db_path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0] == 30
+
+
+def test_expired_lease_is_reclaimed_by_another_process(tmp_path):
+    db_path, record_path = tmp_path / "queue.db", tmp_path / "done.txt"
+    paths = [tmp_path / f"doc{i}.pdf" for i in range(4)]
+    queue = SharedWorkQueue(db_path, policy="fifo")
+    queue.enqueue(paths)
+
+    ctx = multiprocessing.get_context("spawn")
+    # 第一个进程领取doc0后宕机，租约留在数据库中
+    crashed, = _run_processes(ctx, [(db_path, record_path, 1.0, "doc0.pdf", 1)])
+    assert crashed.exitcode == 1
+    assert queue.status_of([paths[0]]) == {queue.key(paths[0]): "claimed"}
+
+    time.sleep(1.2)
+    _run_processes(ctx, [(db_path, record_path, 1.0) for _ in range(2)])
+
+    done = record_path.read_text(encoding="utf-8").split()
+    assert sorted(done) == sorted(str(p) for p in paths)
+    assert queue.counts() == {"done": 4}
+    with sqlite3.connect(str(db_path)) as conn:
+        attempts = conn.execute("SELECT attempts FROM jobs WHERE path = ?",
+                                (queue.key(paths[0]),)).fetchone()[0]
+    assert attempts == 2
+
+
+def test_share_root_identifies_documents_across_mounts(tmp_path):
+    # 两台主机以不同路径挂载同一共享目录
+    mount_a, mount_b = tmp_path / "mount_a", tmp_path / "mount_b"
+    (mount_a / "合同").mkdir(parents=True)
+    mount_b.symlink_to(mount_a, target_is_directory=True)
+    (mount_a / "合同" / "Doc.pdf").write_bytes(b"%PDF-1.7")
+    db_path = tmp_path / "queue.db"
+    host_a = SharedWorkQueue(db_path, host="a", policy="fifo", share_root=mount_a)
+    host_b = SharedWorkQueue(db_path, host="b", policy="fifo", share_root=mount_b)
+
+    assert host_a.enqueue([mount_a / "合同" / "Doc.pdf"]) == 1
+    assert host_b.enqueue([mount_b / "合同" / "doc.PDF"]) == 0
+    assert host_a.key(mount_a / "合同" / "Doc.pdf") == host_b.key(mount_b / "合同" / "DOC.pdf") == "合同/doc.pdf"
+
+    job = host_b.claim()
+    assert job.path == mount_b / "合同" / "Doc.pdf"
+    assert job.path.exists()
+
+
+def test_lost_lease_aborts_processing(tmp_path):
+    db_path, record_path = tmp_path / "queue.db", tmp_path / "done.txt"
+    queue = SharedWorkQueue(db_path, owner="host-a", lease_seconds=0.4, policy="fifo")
+    queue.enqueue([tmp_path / "doc.pdf"])
+    processor = FakeProcessor(record_path, delay=10)
+
+    def steal():
+        # 模拟租约被其他主机收回
+        time.sleep(0.2)
+        with sqlite3.connect(str(db_path)) as conn:
+            conn.execute("UPDATE jobs SET owner = 'host-b', lease_expires = ?", (time.time() + 60,))
+
+    threading.Thread(target=steal).start()
+    started = time.monotonic()
+    run_worker(queue, processor, lambda: False, on_done=lambda job, success: pytest.fail("不应记录结果"))
+    assert time.monotonic() - started < 3
+    assert not record_path.exists()
+    assert not processor.cancel_token.cancelled
+    with sqlite3.connect(str(db_path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0] == 0
+
+
+def test_job_scope_only_aborts_current_thread():
+    token, lost = CancelToken(), threading.Event()
+    lost.set()
+    other_thread = []
+    with token.job_scope(lost):
+        with pytest.raises(JobAborted):
+            token.raise_if_cancelled("OCR")
+        thread = threading.Thread(target=lambda: other_thread.append(token.cancelled))
+        thread.start()
+        thread.join()
+    assert other_thread == [False]
+    assert not token.cancelled
+
+
+def test_locked_database_is_retried(tmp_path, monkeypatch):
+    import work_queue
+    queue = SharedWorkQueue(tmp_path / "queue.db", policy="fifo")
+    queue.enqueue([tmp_path / "doc.pdf"])
+    failures = {"claim": 2, "complete": 1}
+
+    def flaky(name, func):
+        def call(*args, **kwargs):
+            if failures[name]:
+                failures[name] -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return func(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(queue, "claim", flaky("claim", queue.claim))
+    monkeypatch.setattr(queue, "complete", flaky("complete", queue.complete))
+    monkeypatch.setattr(work_queue.time, "sleep", lambda seconds: None)
+    done = []
+    run_worker(queue, FakeProcessor(tmp_path / "done.txt"), lambda: False,
+               on_done=lambda job, success: done.append(success))
+    assert done == [True]
+    assert failures == {"claim": 0, "complete": 0}
+    assert queue.counts() == {"done": 1}
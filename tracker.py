@@ -5,6 +5,15 @@ from pathlib import Path
 from datetime import datetime
 
 class ProcessingTracker:
+    COLUMNS = ["PDF名称", "Markdown", "图片", "图片数量", "处理时间",
+               "Dify状态", "Dify文件ID", "Dify结果", "Dify处理时间", "备注", "文件SHA256",
+               "OCR尝试次数", "Dify尝试次数", "最后错误"]
+    COLUMN_WIDTHS = {
+        'A': 25, 'B': 12, 'C': 10, 'D': 12, 'E': 18,
+        'F': 15, 'G': 25, 'H': 12, 'I': 18, 'J': 40, 'K': 20,
+        'L': 12, 'M': 12, 'N': 40
+    }
+
     def __init__(self, excel_path: Path):
         self.excel_path = excel_path
         self.lock = threading.Lock()
@@ -14,9 +23,7 @@ class ProcessingTracker:
         if self.excel_path.exists():
             try:
                 self.df = pd.read_excel(self.excel_path)
-                required_cols = ["PDF名称", "Markdown", "图片", "图片数量", "处理时间",
-                                 "Dify状态", "Dify文件ID", "Dify结果", "Dify处理时间", "备注"]
-                for col in required_cols:
+                for col in self.COLUMNS:
                     if col not in self.df.columns:
                         self.df[col] = ""
                 print(f"📖 读取现有Excel文件: {len(self.df)} 条记录")
@@ -27,10 +34,7 @@ class ProcessingTracker:
             self._create_new_excel()
 
     def _create_new_excel(self):
-        self.df = pd.DataFrame(columns=[
-            "PDF名称", "Markdown", "图片", "图片数量", "处理时间",
-            "Dify状态", "Dify文件ID", "Dify结果", "Dify处理时间", "备注"
-        ])
+        self.df = pd.DataFrame(columns=self.COLUMNS)
         self._save_excel()
         print("📄 创建新的Excel记录文件")
 
@@ -40,11 +44,7 @@ class ProcessingTracker:
             with pd.ExcelWriter(self.excel_path, engine='openpyxl') as writer:
                 self.df.to_excel(writer, index=False, sheet_name='处理记录')
                 ws = writer.sheets['处理记录']
-                column_widths = {
-                    'A': 25, 'B': 12, 'C': 10, 'D': 12, 'E': 18,
-                    'F': 15, 'G': 25, 'H': 12, 'I': 18, 'J': 40
-                }
-                for col, width in column_widths.items():
+                for col, width in self.COLUMN_WIDTHS.items():
                     ws.column_dimensions[col].width = width
         except Exception as e:
             print(f"❌ 保存Excel文件失败: {e}")
@@ -52,7 +52,8 @@ class ProcessingTracker:
     def update_record(self, pdf_name: str, has_md: bool = None,
                       has_images: bool = None, image_count: int = 0,
                       dify_status: str = "", dify_file_id: str = "",
-                      dify_result: str = "", note: str = ""):
+                      dify_result: str = "", note: str = "", file_hash: str = "",
+                      ocr_attempts: int = 0, dify_attempts: int = 0, last_error: str = ""):
         with self.lock:
             try:
                 current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -76,6 +77,14 @@ class ProcessingTracker:
                         self.df.loc[idx, 'Dify文件ID'] = dify_file_id
                     if dify_result:
                         self.df.loc[idx, 'Dify结果'] = dify_result
+                    if file_hash:
+                        self.df.loc[idx, '文件SHA256'] = file_hash
+                    if ocr_attempts > 0:
+                        self.df.loc[idx, 'OCR尝试次数'] = ocr_attempts
+                    if dify_attempts > 0:
+                        self.df.loc[idx, 'Dify尝试次数'] = dify_attempts
+                    if last_error:
+                        self.df.loc[idx, '最后错误'] = last_error
                     if not self.df.loc[idx, '处理时间']:
                         self.df.loc[idx, '处理时间'] = current_time
                 else:
@@ -89,7 +98,11 @@ class ProcessingTracker:
                         "Dify文件ID": dify_file_id,
                         "Dify结果": dify_result,
                         "Dify处理时间": current_time if dify_status else "",
-                        "备注": note
+                        "备注": note,
+                        "文件SHA256": file_hash,
+                        "OCR尝试次数": ocr_attempts or "",
+                        "Dify尝试次数": dify_attempts or "",
+                        "最后错误": last_error
                     }
                     self.df = pd.concat([self.df, pd.DataFrame([new_record])], ignore_index=True)
 
@@ -1,17 +1,75 @@
 # utils.py
+import atexit
+import hashlib
+import io
 import logging
+import os
 import platform
+import queue
+import reprlib
 import subprocess
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def init_logging():
+from config import Config
+
+LOG_FILE = 'pdf_processor_debug.log'
+
+
+def worker_log_file(worker_id: int = 0) -> str:
+    """
+    --worker模式每个进程写自己的日志文件，多个进程轮转同一个文件会互相覆盖。
+    文件名按主机和--worker-id固定，重启后继续写同一个文件，不会无限增加新文件。
+    """
+    return f"pdf_processor_worker_{Config.HOST_ID}_{worker_id}.log"
+
+
+def init_logging(log_file: str = LOG_FILE):
+    """
+    日志通过队列交给单个后台线程写入，工作线程不再阻塞在磁盘和控制台I/O上。
+    日志文件按大小轮转。
+    """
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    stream_handler = logging.StreamHandler()
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # 队列端只合并消息和参数，时间和级别由后台线程的handler统一格式化
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
     logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('pdf_processor_debug.log', encoding='utf-8')
-        ]
+        level=getattr(logging, Config.LOG_LEVEL, logging.INFO),
+        handlers=[queue_handler]
     )
+    return listener
+
+
+def summarize_payload(payload, limit: int = None) -> str:
+    """把较大的请求/响应内容截断为摘要，完整内容只在DEBUG级别输出。"""
+    limit = limit or Config.LOG_PAYLOAD_LIMIT
+    if isinstance(payload, str):
+        if len(payload) <= limit:
+            return payload
+        return f"{payload[:limit]}...（共 {len(payload)} 字符，已截断）"
+    # 非字符串（如工作流返回的dict）用reprlib按层级和元素个数截断，不先生成完整的字符串
+    summary = reprlib.Repr()
+    summary.maxlevel = 4
+    summary.maxdict = summary.maxlist = summary.maxtuple = summary.maxset = 20
+    summary.maxstring = summary.maxother = min(limit, 200)
+    text = summary.repr(payload)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...（已截断）"
 
 def open_dir(path):
     p = str(path)
@@ -30,3 +88,48 @@ def open_file(path):
         subprocess.Popen(['open', p])
     else:
         subprocess.Popen(['xdg-open', p])
+
+
+class HashingReader(io.BufferedReader):
+    """
+    以流的方式读取文件，同时在同一遍读取中计算内容哈希。
+    用于上传大PDF，避免把整个文件读入内存；重复读取（如seek(0)后重读）不会重复计入哈希。
+    """
+
+    def __init__(self, path, algorithm: str = "sha256"):
+        super().__init__(io.FileIO(os.fspath(path), "rb"))
+        self._hash = hashlib.new(algorithm)
+        self._hashed_upto = 0
+
+    def _update(self, pos: int, data) -> None:
+        end = pos + len(data)
+        if pos <= self._hashed_upto < end:
+            self._hash.update(memoryview(data)[self._hashed_upto - pos:])
+            self._hashed_upto = end
+
+    def read(self, size: int = -1) -> bytes:
+        pos = self.tell()
+        data = super().read(size)
+        self._update(pos, data)
+        return data
+
+    def read1(self, size: int = -1) -> bytes:
+        pos = self.tell()
+        data = super().read1(size)
+        self._update(pos, data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        pos = self.tell()
+        count = super().readinto(buffer)
+        self._update(pos, memoryview(buffer)[:count])
+        return count
+
+    def hexdigest(self) -> str:
+        """返回文件完整内容的哈希；若上传方未读到末尾则补读剩余部分。"""
+        pos = self.tell()
+        self.seek(self._hashed_upto)
+        while self.read(1024 * 1024):
+            pass
+        self.seek(pos)
+        return self._hash.hexdigest()
@@ -0,0 +1,426 @@
+# work_queue.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from config import Config
+from scheduler import estimate_costs
+from cancellation import JobAborted, ProcessingCancelled
+from retry import RETRY_STAGES, RetryableFailure, RetryState
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL,
+    cost REAL NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL DEFAULT 0,
+    enable_dify INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL,
+    claimed_at REAL,
+    finished_at REAL,
+    not_before REAL,
+    retry_stage TEXT,
+    ocr_attempts INTEGER NOT NULL DEFAULT 0,
+    dify_attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires);
+CREATE TABLE IF NOT EXISTS ledger (
+    path TEXT PRIMARY KEY,
+    pdf_name TEXT NOT NULL,
+    host TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    note TEXT,
+    attempts INTEGER,
+    finished_at TEXT
+);
+"""
+
+# 旧版本数据库缺少的列（临时失败重试）
+_MIGRATIONS = {
+    "not_before": "REAL",
+    "retry_stage": "TEXT",
+    "ocr_attempts": "INTEGER NOT NULL DEFAULT 0",
+    "dify_attempts": "INTEGER NOT NULL DEFAULT 0",
+    "last_error": "TEXT",
+    "source": "TEXT",
+}
+
+# 与scheduler的调度策略对应的领取顺序
+_CLAIM_ORDER = {
+    "fifo": "priority DESC, id",
+    "sjf": "priority DESC, cost ASC, id",
+    "ljf": "priority DESC, cost DESC, id",
+}
+
+
+def host_excel_path() -> Path:
+    """多机模式下每台机器写自己的Excel，避免多台机器同时重写同一个文件。"""
+    excel_path = Config.EXCEL_PATH
+    return excel_path.with_name(f"{excel_path.stem}_{Config.HOST_ID}{excel_path.suffix}")
+
+
+class ClaimedJob:
+    def __init__(self, job_id: int, key: str, path: Path, enable_dify: bool, attempts: int,
+                 retry_state: RetryState = None):
+        self.id = job_id
+        self.key = key
+        self.path = Path(path)
+        self.enable_dify = enable_dify
+        self.attempts = attempts
+        self.retry_state = retry_state or RetryState()
+
+
+class SharedWorkQueue:
+    """
+    多台机器共享的SQLite任务队列。
+    每台机器用租约原子地领取文档并定期续约；租约过期（主机宕机）的文档会被其他机器重新领取。
+    处理结果写入同一数据库的台账表，汇总所有机器的结果。
+    数据库放在共享目录时不使用WAL（网络文件系统不支持），依赖SQLite自身的文件锁。
+    配置了共享根目录（各主机按自己的挂载位置设置）时，文档以相对该目录的路径标识，
+    不同主机以不同方式挂载同一共享目录（Z:\、\\srv\share、/mnt/share）也能识别为同一文档并打开。
+    """
+
+    def __init__(self, db_path: Path = None, host: str = None, owner: str = None,
+                 lease_seconds: float = None, policy: str = None, share_root: Path = None):
+        self.db_path = Path(db_path or Config.WORK_QUEUE_DB)
+        share_root = share_root or Config.WORK_QUEUE_SHARE_ROOT
+        self.share_root = Path(os.path.abspath(share_root)) if share_root else None
+        self.host = host or Config.HOST_ID
+        self.owner = owner or f"{self.host}:{os.getpid()}"
+        self.lease_seconds = lease_seconds or Config.WORK_QUEUE_LEASE_SECONDS
+        self.claim_order = _CLAIM_ORDER[policy or Config.SCHEDULER_POLICY]
+        self.logger = logging.getLogger(f"{__name__}.SharedWorkQueue")
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in _MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    @contextmanager
+    def _connect(self, timeout: float = 30):
+        # 每次操作使用独立连接，sqlite3连接不能跨线程共享
+        conn = sqlite3.connect(str(self.db_path), timeout=timeout, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _source(self, path) -> str:
+        """文档在队列中保存的位置：共享根目录下的相对路径（统一用/分隔），不在共享目录下时为本机绝对路径。"""
+        path = os.path.abspath(str(path))
+        if self.share_root:
+            try:
+                relative = os.path.relpath(path, self.share_root)
+            except ValueError:  # Windows下位于不同盘符
+                relative = os.pardir
+            if relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+                return relative.replace(os.sep, "/")
+        return os.path.normpath(path)
+
+    def key(self, path) -> str:
+        """文档标识：共享目录下的文件按相对路径且不区分大小写（共享目录由Windows主机访问），其他按本机规则normcase。"""
+        source = self._source(path)
+        if os.path.isabs(source):
+            return os.path.normcase(source)
+        return source.lower()
+
+    def resolve(self, source: str) -> Path:
+        """把队列中保存的位置转换为本机可以打开的路径。"""
+        if self.share_root and not os.path.isabs(source):
+            return self.share_root.joinpath(*source.split("/"))
+        return Path(source)
+
+    def enqueue(self, paths: Iterable[Path], enable_dify: bool = False,
+                high_priority: Iterable[Path] = ()) -> int:
+        """加入队列，已在队列中（包括已完成）的文档不会重复加入。返回新加入数量。"""
+        high_priority = {self.key(p) for p in high_priority}
+        paths = list(paths)
+        # 只为新文档估算成本（各主机的调度策略可能不同，成本总是写入）
+        queued = self.status_of(paths)
+        new_paths = [p for p in paths if self.key(p) not in queued]
+        if self.share_root:
+            outside = [p for p in new_paths if os.path.isabs(self._source(p))]
+            if outside:
+                self.logger.warning(f"⚠️ {len(outside)} 个文件不在共享根目录 {self.share_root} 下，"
+                                    f"其他主机可能无法打开: {Path(outside[0]).name} 等")
+        now = time.time()
+        rows = [
+            (self.key(p), self._source(p), cost, int(self.key(p) in high_priority), int(enable_dify), now)
+            for p, cost in zip(new_paths, estimate_costs(new_paths))
+        ]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, source, cost, priority, enable_dify, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        return added
+
+    def bump(self, path: Path) -> bool:
+        with self._connect() as conn:
+            cur = conn.execute("UPDATE jobs SET priority = 1 WHERE path = ? AND status = 'pending'",
+                               (self.key(path),))
+            return cur.rowcount == 1
+
+    def claim(self) -> Optional[ClaimedJob]:
+        """原子地领取一个待处理或租约已过期的文档。"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 超过最大尝试次数仍未完成的文档（反复导致主机宕机）直接标记失败
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', owner = NULL, finished_at = ? "
+                    "WHERE status = 'claimed' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, Config.WORK_QUEUE_MAX_ATTEMPTS)
+                )
+                row = conn.execute(
+                    "SELECT id, path, source, enable_dify, attempts, owner, retry_stage, ocr_attempts, "
+                    "dify_attempts, last_error FROM jobs "
+                    "WHERE (status = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                    "OR (status = 'claimed' AND lease_expires < ?) "
+                    f"ORDER BY {self.claim_order} LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                (job_id, key, source, enable_dify, attempts, previous_owner,
+                 retry_stage, ocr_attempts, dify_attempts, last_error) = row
+                conn.execute(
+                    "UPDATE jobs SET status = 'claimed', owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                    (self.owner, now + self.lease_seconds, now, job_id)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        # 旧版本加入的任务没有source，path即本机路径
+        path = self.resolve(source or key)
+        if previous_owner:
+            self.logger.warning(f"♻️ 回收过期租约: {path.name}（原主机 {previous_owner}）")
+        retry_state = RetryState(retry_stage or "ocr", {"ocr": ocr_attempts, "dify": dify_attempts},
+                                 last_error or "")
+        return ClaimedJob(job_id, key, path, bool(enable_dify), attempts + 1, retry_state)
+
+    def heartbeat(self, job: ClaimedJob) -> bool:
+        """续约，返回False表示租约已被其他主机收回。"""
+        # 等锁时间不超过续约间隔，保证一次续约（等待间隔+等锁）在租约过期前结束
+        with self._connect(timeout=self.lease_seconds / 4) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'claimed'",
+                (time.time() + self.lease_seconds, job.id, self.owner)
+            )
+            return cur.rowcount == 1
+
+    def release(self, job: ClaimedJob):
+        """放弃租约（例如用户停止处理），文档回到待处理状态。"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL, lease_expires = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND owner = ? AND status = 'claimed'",
+                (job.id, self.owner)
+            )
+
+    def retry_later(self, job: ClaimedJob, delay: float):
+        """临时失败的文档延迟 delay 秒后重新变为可领取，任何主机都可以接手重试。"""
+        state = job.retry_state
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL, lease_expires = NULL, not_before = ?, "
+                "retry_stage = ?, ocr_attempts = ?, dify_attempts = ?, last_error = ?, attempts = attempts - 1 "
+                "WHERE id = ? AND owner = ? AND status = 'claimed'",
+                (time.time() + delay, state.stage, state.attempts["ocr"], state.attempts["dify"],
+                 state.last_error, job.id, self.owner)
+            )
+
+    def next_retry_at(self) -> Optional[float]:
+        """最早一个等待重试的文档可被领取的时间，没有等待重试的文档时返回None。"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def complete(self, job: ClaimedJob, success: bool, note: str = "") -> bool:
+        """记录处理结果到台账，返回False表示租约已被其他主机收回（结果以接手的主机为准，不写台账）。"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, finished_at = ?, "
+                "ocr_attempts = ?, dify_attempts = ?, last_error = ? "
+                "WHERE id = ? AND owner = ? AND status = 'claimed'",
+                ("done" if success else "failed", now, job.retry_state.attempts["ocr"],
+                 job.retry_state.attempts["dify"], job.retry_state.last_error, job.id, self.owner)
+            )
+            if cur.rowcount == 1:
+                conn.execute(
+                    "INSERT OR REPLACE INTO ledger (path, pdf_name, host, success, note, attempts, finished_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job.key, job.path.name, self.host, int(success), note, job.attempts,
+                     datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"))
+                )
+            conn.execute("COMMIT")
+        return cur.rowcount == 1
+
+    @contextmanager
+    def lease(self, job: ClaimedJob):
+        """
+        处理期间在后台线程中定期续约，返回租约丢失标记（threading.Event）。
+        续约被拒绝，或连续续约失败到租约只剩1/4时，标记被set，处理方应中止该文档，
+        避免租约过期后与接手的主机重复处理。
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+        interval = self.lease_seconds / 4
+
+        def renew():
+            renewed_at = time.monotonic()
+            while not stop.wait(interval):
+                try:
+                    if self.heartbeat(job):
+                        renewed_at = time.monotonic()
+                        continue
+                    self.logger.warning(f"⚠️ 租约已被收回，中止处理: {job.path.name}")
+                    lost.set()
+                    return
+                except Exception as e:
+                    self.logger.warning(f"续约失败 {job.path.name}: {e}")
+                if time.monotonic() - renewed_at >= self.lease_seconds - interval:
+                    self.logger.warning(f"⚠️ 长时间无法续约，租约即将过期，中止处理: {job.path.name}")
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=renew, name=f"lease-{job.id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def status_of(self, paths: Iterable[Path]) -> Dict[str, str]:
+        keys = [self.key(p) for p in paths]
+        statuses = {}
+        with self._connect() as conn:
+            # 分批查询，避免超过SQLite的参数个数上限
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                statuses.update(conn.execute(
+                    f"SELECT path, status FROM jobs WHERE path IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return statuses
+
+    def export_ledger(self, excel_path: Path) -> int:
+        """把所有主机的处理台账导出为一个Excel文件，返回记录数。"""
+        import pandas as pd
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                "SELECT l.pdf_name AS 'PDF名称', l.host AS '处理主机', "
+                "CASE l.success WHEN 1 THEN '✅' ELSE '❌' END AS '结果', "
+                "l.attempts AS '尝试次数', j.ocr_attempts AS 'OCR尝试次数', j.dify_attempts AS 'Dify尝试次数', "
+                "l.note AS '备注', j.last_error AS '最后错误', l.finished_at AS '完成时间', l.path AS '路径' "
+                "FROM ledger l LEFT JOIN jobs j ON j.path = l.path ORDER BY l.finished_at", conn
+            )
+        excel_path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_excel(excel_path, index=False, sheet_name='合并台账')
+        return len(df)
+
+
+def _with_db_retry(func, description: str, should_stop: Callable[[], bool], logger):
+    """
+    共享目录上的数据库可能被其他主机长时间锁住（database is locked），退避后重试直到成功。
+    已被停止时不再等待，返回None。
+    """
+    delay = 1.0
+    while True:
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            if should_stop():
+                logger.error(f"❌ {description}失败（已停止，不再重试）: {e}")
+                return None
+            logger.warning(f"⚠️ {description}失败，{delay:.0f}s后重试: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+def run_worker(queue: SharedWorkQueue, processor, should_stop: Callable[[], bool],
+               on_start: Callable[[ClaimedJob], None] = None,
+               on_done: Callable[[ClaimedJob, bool], None] = None,
+               on_retry: Callable[[ClaimedJob, RetryableFailure, float], None] = None):
+    """工作线程循环：领取文档、处理并写入台账，直到队列为空或被停止。临时失败的文档延迟后放回队列。"""
+    logger = logging.getLogger(__name__)
+    while not should_stop():
+        job = _with_db_retry(queue.claim, "领取任务", should_stop, logger)
+        if job is None:
+            retry_at = _with_db_retry(queue.next_retry_at, "查询等待重试的任务", should_stop, logger)
+            if retry_at is None:
+                return
+            # 只剩等待重试的文档，到时间后再领取
+            while time.time() < retry_at and not should_stop():
+                time.sleep(min(1.0, max(retry_at - time.time(), 0)))
+            continue
+        if on_start:
+            on_start(job)
+        state = job.retry_state
+        try:
+            with queue.lease(job) as lost, processor.cancel_token.job_scope(lost):
+                if state.stage == "dify":
+                    success = bool(processor.resume_dify(job.path, state))
+                else:
+                    success = bool(processor.process_pdf(job.path, job.enable_dify, state))
+        except RetryableFailure as e:
+            delay = state.next_delay()
+            logger.warning(f"⏳ {e}，{delay:.0f}s后重试: {job.path.name}")
+            _with_db_retry(lambda: queue.retry_later(job, delay), "放回队列", should_stop, logger)
+            if on_retry:
+                on_retry(job, e, delay)
+            continue
+        except JobAborted:
+            # 租约已丢失，文档由接手的主机处理，这里既不写台账也不放回队列
+            logger.warning(f"⏹️ 租约丢失，已放弃: {job.path.name}")
+            continue
+        except ProcessingCancelled:
+            _with_db_retry(lambda: queue.release(job), "释放租约", should_stop, logger)
+            raise
+        except Exception as e:
+            logger.error(f"💥 处理文件异常 {job.path.name}: {e}")
+            state.last_error = str(e)
+            state.failed_stage = state.stage
+            success = False
+        if state.failed_stage:
+            note = f"{RETRY_STAGES[state.failed_stage]}失败: {state.last_error}"
+        else:
+            note = "处理完成" if success else "处理失败"
+        recorded = _with_db_retry(lambda: queue.complete(job, success, note), "写入台账", should_stop, logger)
+        if recorded is None:
+            logger.error(f"❌ 结果未能写入台账，租约过期后将由其他主机重新处理: {job.path.name}")
+            continue
+        if not recorded:
+            logger.warning(f"⚠️ 租约已被其他主机收回，结果以接手的主机为准: {job.path.name}")
+            continue
+        if on_done:
+            on_done(job, success)